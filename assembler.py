@@ -0,0 +1,286 @@
+"""Assembler core: turns assembly source into machine code words.
+
+Every line is read once: comments are stripped, the line is split into
+tokens and turned into an Instruction (the IR) carrying its size, address
+and source location. Operands are checked and encoded in the same pass,
+references to labels that are not defined yet are left as fix-ups and
+patched once all labels are known.
+
+assemble() is the API for other code: it returns the machine code as an
+array and keeps it in an on-disk cache keyed on a hash of the source and
+the assembler version, so unchanged programs skip assembly altogether.
+asm-to-prg.py prints the diagnostics for people.
+
+Instruction formats (one word each for the opcode and every operand):
+    ldw  r, value       str / ldr  r, address
+    mov add sub xor and mul div  r, r
+    push / pop  r       jmp / jsr  label       ret
+    int  number or name (see INTERRUPTS)
+    bne / beq / blt  r, r, label
+Instructions with fewer than two operands are padded to three words.
+"""
+
+import hashlib, os, tempfile
+from array import array
+from collections import namedtuple
+
+
+# mnemonic -> (opcode, operand kinds): r register, v value, m memory address,
+# l label, i interrupt
+INSTRUCTIONS = {
+    "ldw": (0x01, "rv"),
+    "mov": (0x02, "rr"),
+    "add": (0x03, "rr"),
+    "sub": (0x04, "rr"),
+    "str": (0x05, "rm"),
+    "ldr": (0x06, "rm"),
+    "bne": (0x08, "rrl"),
+    "beq": (0x09, "rrl"),
+    "int": (0x0A, "i"),
+    "push": (0x0B, "r"),
+    "pop": (0x0C, "r"),
+    "jsr": (0x0D, "l"),
+    "ret": (0x0E, ""),
+    "xor": (0x0F, "rr"),
+    "and": (0x10, "rr"),
+    "jmp": (0x11, "l"),
+    "mul": (0x12, "rr"),
+    "div": (0x13, "rr"),
+    "blt": (0x14, "rrl"),
+}
+
+REGISTERS = {"a": 0x0, "b": 0x1, "c": 0x2, "d": 0x3, "e": 0x4, "f": 0x5}
+
+# named interrupts, so 'int fill_rect' is the same as 'int 0x73'
+INTERRUPTS = {
+    "print_char": 0x00, "print_int": 0x01,
+    "halt": 0xFF, "error": 0xFE, "key": 0xF6, "next_key": 0xF7,
+    "init_graphics": 0x70, "set_pixel": 0x71, "set_char": 0x72,
+    "fill_rect": 0x73, "hline": 0x74, "vline": 0x75, "blit": 0x76,
+    "read_byte": 0x80, "write_byte": 0x81,
+    "read_sectors": 0x82, "write_sectors": 0x83, "sync": 0x84,
+}
+
+VERSION = 1  # bump when the machine code for a source changes, invalidates the cache
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "py502", "asm")
+
+MEMORY_LIMIT = 256  # words of memory the program has to fit in
+STACK_WARNING = 16  # pushes without pops before warning
+
+
+def size(kinds):
+    """Words taken by an instruction with these operand kinds."""
+    return 1 + max(2, len(kinds))
+
+
+# operands are parsed: register numbers and values as ints, labels by name
+Instruction = namedtuple("Instruction", "mnemonic operands address size line_number text")
+
+# words: the machine code, labels: name -> address, instructions: the IR,
+# errors / warnings: (line number, message, source line), line 0 for the whole file
+Assembly = namedtuple("Assembly", "words labels instructions errors warnings")
+
+
+class AssemblyError(ValueError):
+    """The source has errors, (line number, message, source line) tuples in .errors."""
+
+    def __init__(self, errors, filename="<source>"):
+        self.errors = errors
+        lines = [f"{filename}:{line_number}: error: {message}" if line_number else f"{filename}: error: {message}"
+                 for line_number, message, _ in errors]
+        super().__init__("\n".join(lines))
+
+
+def convert_to_int(value):
+    if value.startswith("0x"):  # Handle hexadecimal strings
+        return int(value, 16)
+    return int(value)  # Handle decimal strings
+
+
+def assemble_lines(lines, memory_limit=MEMORY_LIMIT):
+    """Assemble source lines, returns an Assembly (check its errors before using the words)."""
+    words = []
+    labels = {}
+    instructions = []
+    errors = []
+    warnings = []
+    fixups = []  # (index in words, label, line number, source line)
+    stores = []  # (address, line number, source line, code) checked against the final program size
+    stack_balance = 0
+    registers = REGISTERS
+    table = INSTRUCTIONS
+
+    for line_number, line in enumerate(lines, start=1):
+        line = line.rstrip("\r\n")
+        comment = line.find(";")
+        code = (line if comment < 0 else line[:comment]).strip()
+        if not code:
+            continue
+
+        # Handle labels
+        if code[-1] == ":":
+            label = code[:-1].strip()
+            if label in labels:
+                warnings.append((line_number, f"duplicate label '{label}'", line))
+            labels[label] = len(words)
+            continue
+
+        tokens = code.replace(",", " ").split()
+        mnemonic = tokens[0].lower()
+        operands = tokens[1:]
+        entry = table.get(mnemonic)
+        if entry is None:
+            errors.append((line_number, f"unknown instruction '{mnemonic}'", line))
+            continue
+        opcode, kinds = entry
+        length = size(kinds)
+        address = len(words)
+
+        if len(operands) != len(kinds):
+            if kinds == "rrl":
+                message = f"branch instruction '{mnemonic}' should have 2 registers and 1 label"
+            elif kinds == "l":
+                message = f"'{mnemonic}' instruction should have 1 operand (label)"
+            else:
+                message = f"'{mnemonic}' instruction should have {len(kinds)} operand(s)"
+            errors.append((line_number, message, line))
+            instructions.append(Instruction(mnemonic, tuple(operands), address, length, line_number, line))
+            words += [opcode] + [0] * (length - 1)
+            continue
+
+        encoded = [opcode]
+        bad_registers = []
+        for kind, operand in zip(kinds, operands):
+            if kind == "r":
+                register = registers.get(operand.lower())
+                if register is None:
+                    bad_registers.append(operand)
+                    register = 0
+                encoded.append(register)
+            elif kind == "l":
+                target = labels.get(operand)
+                if target is None:
+                    fixups.append((address + len(encoded), operand, line_number, line))
+                    target = 0
+                encoded.append(target)
+            elif kind == "i" and operand.lower() in INTERRUPTS:
+                encoded.append(INTERRUPTS[operand.lower()])
+            elif kind == "m":
+                try:
+                    value = convert_to_int(operand)
+                except ValueError:
+                    errors.append((line_number, f"invalid memory address '{operand}'", line))
+                    value = 0
+                else:
+                    access = "write" if opcode == 0x05 else "read"
+                    if not 0 <= value < memory_limit:
+                        errors.append((line_number, f"illegal memory {access} out of bounds in '{code}'", line))
+                    elif opcode == 0x05:
+                        stores.append((value, line_number, line, code))
+                encoded.append(value)
+            else:  # v, i: a number
+                try:
+                    value = convert_to_int(operand)
+                except ValueError:
+                    errors.append((line_number, f"invalid value '{operand}'", line))
+                    value = 0
+                encoded.append(value)
+        if bad_registers:
+            if len(kinds) == 1 or kinds[1] != "r":
+                message = f"invalid register '{bad_registers[0]}'"
+            else:
+                message = f"invalid register(s) in '{mnemonic if kinds == 'rrl' else code}'"
+            errors.append((line_number, message, line))
+        values = tuple(operand if kind == "l" else value
+                       for kind, operand, value in zip(kinds, operands, encoded[1:]))
+        instructions.append(Instruction(mnemonic, values, address, length, line_number, line))
+        encoded += [0] * (length - len(encoded))  # padding
+        words += encoded
+
+        if mnemonic == "push":
+            stack_balance += 1
+            if stack_balance > STACK_WARNING:
+                warnings.append((line_number, "stack overflow detected", line))
+        elif mnemonic == "pop":
+            stack_balance -= 1
+            if stack_balance < 0:
+                errors.append((line_number, f"stack underflow detected at '{code}'", line))
+
+    # Resolve forward references
+    for index, label, line_number, line in fixups:
+        target = labels.get(label)
+        if target is None:
+            errors.append((line_number, f"undefined label '{label}'", line))
+        else:
+            words[index] = target
+
+    program_length = len(words)
+    for address, line_number, line, code in stores:
+        if address < program_length:
+            errors.append((line_number, f"illegal memory write to program space in '{code}'", line))
+
+    if stack_balance != 0:
+        warnings.append((0, "stack imbalance detected, unbalanced push/pop operations", ""))
+    if program_length >= memory_limit:
+        errors.append((0, f"Program too big, size: {program_length}", ""))
+
+    errors.sort(key=lambda error: error[0] or float("inf"))  # in source order, whole-file errors last
+    return Assembly(words, labels, instructions, errors, warnings)
+
+
+def encode(instructions, labels):
+    """Machine code words for IR instructions, labels (name -> address) resolved."""
+    words = []
+    for instruction in instructions:
+        opcode, kinds = INSTRUCTIONS[instruction.mnemonic]
+        words.append(opcode)
+        for kind, operand in zip(kinds, instruction.operands):
+            words.append(labels[operand] if kind == "l" else operand)
+        words += [0] * (instruction.size - 1 - len(kinds))  # padding
+    return words
+
+
+def _cache_path(source, memory_limit, optimize, cache_dir):
+    key = hashlib.sha256(f"{VERSION}:{memory_limit}:{optimize:d}:".encode() + source.encode()).hexdigest()
+    return os.path.join(cache_dir, key + ".bin")
+
+
+def assemble(source, memory_limit=MEMORY_LIMIT, cache_dir=CACHE_DIR, filename="<source>", optimize=False):
+    """Assemble source text into an array("q") of words, raises AssemblyError.
+
+    optimize runs the peephole optimizer (see optimizer.py). Results are
+    cached in cache_dir (None to not use the cache), a broken or
+    unwritable cache only costs the speed.
+    """
+    path = _cache_path(source, memory_limit, optimize, cache_dir) if cache_dir is not None else None
+    if path is not None:
+        try:
+            with open(path, "rb") as f:
+                return array("q", f.read())
+        except (OSError, ValueError):
+            pass
+
+    assembly = assemble_lines(source.splitlines(), memory_limit)
+    if assembly.errors:
+        raise AssemblyError(assembly.errors, filename)
+    if optimize:
+        from optimizer import optimize as optimize_assembly  # imports this module
+        assembly, _ = optimize_assembly(assembly)
+    words = array("q", assembly.words)
+
+    if path is not None:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            fd, temp = tempfile.mkstemp(dir=cache_dir)
+            with os.fdopen(fd, "wb") as f:
+                f.write(words.tobytes())
+            os.replace(temp, path)  # readers never see a half-written file
+        except OSError:
+            pass
+    return words
+
+
+def assemble_file(path, memory_limit=MEMORY_LIMIT, cache_dir=CACHE_DIR, optimize=False):
+    """assemble() the source file at path."""
+    with open(path) as f:
+        return assemble(f.read(), memory_limit, cache_dir, filename=path, optimize=optimize)
@@ -0,0 +1,131 @@
+"""Run many guest programs across a process pool.
+
+Each Job is a program with optional initial registers and memory and a
+cycle limit. run_batch() spreads the jobs over one worker process per
+core and returns a Result per job, in order, with the final registers,
+PC, cycle count and SHA-256 digests of the registers and memory, ready
+to compare between emulator versions or against a reference.
+
+Guests run headless, their prints are captured into Result.output, and
+each job gets its own empty drive directory. A job that fails on the
+host side (bad memory size, missing program file, initial memory out of
+range, an emulator bug, ...) gets a Result with error saying why, the
+other jobs are not affected.
+
+    python batch.py program1.asm program2.prg --cycles 100000
+"""
+
+import argparse, contextlib, hashlib, io, os, sys, tempfile
+from array import array
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from drives import DriveSet
+from main import CPU, read_program
+from memory import chunks
+
+
+MAX_CYCLES = 1000000  # default cycle limit per job
+
+
+class Job(namedtuple("Job", "program registers memory max_cycles memory_size jit")):
+    """A guest run.
+
+    registers  initial register values, a list (A, B, ...) or None
+    memory     initial memory, {address: [words]} written after the program, or None
+    """
+    __slots__ = ()
+
+    def __new__(cls, program, registers=None, memory=None, max_cycles=MAX_CYCLES, memory_size=256, jit=False):
+        return super().__new__(cls, program, registers, memory, max_cycles, memory_size, jit)
+
+
+# error is None, or why the job failed: then the rest is the machine's state when it failed,
+# or None everywhere (output aside) if there was no machine yet
+Result = namedtuple("Result", "registers pc cycles halted register_digest memory_digest output error",
+                    defaults=(None,))
+
+
+def _set_up(cpu, job):
+    """Load the job's program, memory and registers into cpu."""
+    cpu.load_program(job.program)
+    for address, words in (job.memory or {}).items():
+        if not 0 <= address <= len(cpu.memory) - len(words):
+            raise ValueError(f"Initial memory out of range: {len(words)} words at {address}")
+        words = array(cpu.memory.typecode, [word & cpu.word_mask for word in words])
+        cpu.memory[address:address + len(words)] = words
+    registers = job.registers or ()
+    if len(registers) > len(cpu.regs):
+        raise ValueError(f"Too many initial registers: {len(registers)}")
+    cpu.regs[:len(registers)] = registers
+
+
+def run_job(job):
+    """Run one job in this process."""
+    output = io.StringIO()
+    error = None
+    cpu = None
+    with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(output):
+        drives = DriveSet(directory)
+        try:
+            cpu = CPU(memory_size=job.memory_size, jit=job.jit, display="headless", drives=drives)
+            _set_up(cpu, job)
+            cpu.run(max_cycles=job.max_cycles)
+        except Exception as e:  # one bad job must not take the whole batch down
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            drives.close()  # also when the job stopped on max_cycles, pool workers live on
+
+    if cpu is None:
+        return Result(None, None, None, None, None, None, output.getvalue(), error)
+    registers = tuple(cpu.regs)
+    memory_digest = hashlib.sha256()
+    for chunk in chunks(cpu.memory):  # paged memory is hashed page by page, same digest
+        memory_digest.update(chunk)
+    return Result(
+        registers=registers,
+        pc=cpu.PC,
+        cycles=cpu.cycles,
+        halted=not cpu.running,
+        register_digest=hashlib.sha256(repr(registers).encode()).hexdigest(),
+        memory_digest=memory_digest.hexdigest(),
+        output=output.getvalue(),
+        error=error,
+    )
+
+
+def run_batch(jobs, workers=None, chunksize=None):
+    """Run jobs on a pool of worker processes (default: one per core), returns the Results in order."""
+    jobs = list(jobs)
+    workers = workers or os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = max(1, len(jobs) // (workers * 4))  # a few chunks per worker evens out the load
+    if workers == 1:
+        return [run_job(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run_job, jobs, chunksize=chunksize))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run programs in parallel and print their final state digests.")
+    parser.add_argument("programs", nargs="+", help=".asm sources or files with the word list printed by asm-to-prg.py")
+    parser.add_argument("--cycles", type=int, default=MAX_CYCLES, help="cycle limit per program")
+    parser.add_argument("--memory-size", type=int, default=256, help="memory size in words")
+    parser.add_argument("--jit", action="store_true", help="compile basic blocks to Python")
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per core)")
+    args = parser.parse_args(argv)
+
+    jobs = [Job(read_program(path, args.memory_size), max_cycles=args.cycles, memory_size=args.memory_size,
+                jit=args.jit) for path in args.programs]
+    for path, result in zip(args.programs, run_batch(jobs, args.workers)):
+        if result.error is not None:
+            print(f"{path}  error: {result.error}")
+            continue
+        state = "halted" if result.halted else "running"
+        print(f"{path}  {result.cycles:>10} cycles  {state:<7}  "
+              f"registers {result.register_digest[:16]}  memory {result.memory_digest[:16]}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
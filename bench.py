@@ -0,0 +1,186 @@
+"""Benchmark the emulator on a fixed corpus of guest programs.
+
+Every program is assembled (through the assembler cache) and run headless in its
+own process for a fixed number of guest instructions. Programs that stop
+early (halt or error) are restarted until the budget is used up. The
+run is split into frames of SLICE_INSTRUCTIONS instructions, like the
+uncapped run loop.
+
+Reported per program, best of --repeat runs: instructions per second,
+host time per frame (mean and worst) and the peak resident memory of
+the process.
+
+    python bench.py                   run and compare with benchmarks/baseline.json
+    python bench.py --jit             same with the basic-block compiler
+    python bench.py --save-baseline   store the results as the new baseline
+
+Exits with status 1 when a program is slower than the baseline by more
+than the threshold (10% by default). The baseline is machine specific,
+save a new one before comparing on another host.
+"""
+
+import argparse, contextlib, io, json, os, subprocess, sys, tempfile, time
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+CORPUS = {
+    "gradiant": "gradiant.asm",
+    "example": "example.asm",
+    "alu": "benchmarks/alu.asm",
+    "calls": "benchmarks/calls.asm",
+    "stack": "benchmarks/stack.asm",
+    "disk": "benchmarks/disk.asm",
+    "text": "benchmarks/text.asm",
+}
+
+BASELINE = os.path.join(HERE, "benchmarks", "baseline.json")
+CYCLES = 200000  # guest instructions per program
+THRESHOLD = 0.10  # allowed slowdown against the baseline
+REPEAT = 3  # runs per program, the fastest counts
+
+
+def assemble(path):
+    """Assemble an .asm file, returns the list of words."""
+    sys.path.insert(0, HERE)
+    from assembler import assemble_file
+    return assemble_file(path).tolist()
+
+
+def run_program(program, cycles, jit):
+    """Run program for cycles instructions in this process, returns the measurements."""
+    sys.path.insert(0, HERE)
+    from main import CPU, SLICE_INSTRUCTIONS
+    from drives import DriveSet
+
+    with tempfile.TemporaryDirectory() as directory:
+        open(os.path.join(directory, "drive0.bin"), "wb").close()  # for the disk kernel
+        drives = DriveSet(directory)
+        frame_times = []
+        finished = 0  # instructions of the runs that stopped
+        cpu = None
+        with contextlib.redirect_stdout(io.StringIO()):  # guest prints and error reports
+            start = time.perf_counter()
+            while True:
+                if cpu is None or not cpu.running:
+                    finished += cpu.cycles if cpu else 0
+                    cpu = CPU(display="headless", jit=jit, drives=drives)
+                    cpu.load_program(program)
+                left = cycles - finished - cpu.cycles
+                if left <= 0:
+                    break
+                frame_start = time.perf_counter()
+                cpu.run(max_cycles=cpu.cycles + min(SLICE_INSTRUCTIONS, left))
+                frame_times.append(time.perf_counter() - frame_start)
+            elapsed = time.perf_counter() - start
+        executed = finished + cpu.cycles
+        drives.close()
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None
+    return {
+        "instructions": executed,
+        "seconds": elapsed,
+        "ips": executed / elapsed,
+        "frame_ms": 1000 * sum(frame_times) / len(frame_times),
+        "worst_frame_ms": 1000 * max(frame_times),
+        "peak_kb": peak,  # ru_maxrss, KiB on Linux
+    }
+
+
+def run_corpus(names, cycles, jit, repeat=REPEAT):
+    """Run every program repeat times, each in a fresh process, returns {name: fastest measurements}."""
+    results = {}
+    for name in names:
+        program = assemble(os.path.join(HERE, CORPUS[name]))
+        command = [sys.executable, os.path.abspath(__file__), "--worker", json.dumps(program),
+                   "--cycles", str(cycles)] + (["--jit"] if jit else [])
+        for _ in range(repeat):
+            result = subprocess.run(command, capture_output=True, text=True)
+            if result.returncode != 0:
+                raise RuntimeError(f"{name} failed:\n{result.stderr}")
+            result = json.loads(result.stdout)
+            if name not in results or result["ips"] > results[name]["ips"]:
+                results[name] = result
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Regressions against the baseline, as a list of messages."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["ips"] < base["ips"] * (1 - threshold):
+            regressions.append(f"{name}: {result['ips']:,.0f} instructions/s, baseline {base['ips']:,.0f}")
+        if result["frame_ms"] > base["frame_ms"] * (1 + threshold):
+            regressions.append(f"{name}: {result['frame_ms']:.3f} ms/frame, baseline {base['frame_ms']:.3f}")
+    return regressions
+
+
+def report(results, baseline):
+    print(f"{'program':<10} {'instr/s':>12} {'vs base':>8} {'ms/frame':>9} {'worst ms':>9} {'peak MiB':>9}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        change = f"{result['ips'] / base['ips'] - 1:+.1%}" if base else "-"
+        peak = f"{result['peak_kb'] / 1024:.1f}" if result["peak_kb"] is not None else "-"
+        print(f"{name:<10} {result['ips']:>12,.0f} {change:>8} {result['frame_ms']:>9.3f} "
+              f"{result['worst_frame_ms']:>9.3f} {peak:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the emulator on the program corpus.")
+    parser.add_argument("programs", nargs="*", metavar="program",
+                        help=f"programs to run, from {', '.join(CORPUS)} (default: all)")
+    parser.add_argument("--cycles", type=int, default=CYCLES, help="guest instructions per program")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="runs per program, the fastest counts")
+    parser.add_argument("--jit", action="store_true", help="use the basic-block compiler")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline file to compare with")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="allowed slowdown before failing (0.1 = 10%%)")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_program(json.loads(args.worker), args.cycles, args.jit)))
+        return 0
+
+    unknown = [name for name in args.programs if name not in CORPUS]
+    if unknown:
+        parser.error(f"unknown program: {', '.join(unknown)}")
+
+    key = "jit" if args.jit else "interpreter"
+    stored = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            stored = json.load(f)
+    baseline = stored.get(key, {})
+
+    results = run_corpus(args.programs or list(CORPUS), args.cycles, args.jit, args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        report(results, baseline)
+
+    if args.save_baseline:
+        stored[key] = {**baseline, **results}
+        with open(args.baseline, "w") as f:
+            json.dump(stored, f, indent=2)
+            f.write("\n")
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+    for message in regressions:
+        print("REGRESSION", message, file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
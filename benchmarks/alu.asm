@@ -0,0 +1,19 @@
+; ALU kernel: register arithmetic in a tight loop, no interrupts.
+; Runs until the benchmark's cycle budget runs out.
+
+main:
+    ldw a, 0          ; accumulator
+    ldw b, 1          ; increment
+    ldw c, 3          ; multiplier / divisor
+    ldw d, 0xFFFF     ; mask
+    ldw f, 0          ; loop counter
+
+loop:
+    add a, b          ; a += 1
+    mul a, c          ; a *= 3
+    xor a, d          ; flip the low bits
+    and a, d          ; keep a small
+    sub a, b          ; a -= 1
+    div a, c          ; a //= 3
+    add f, b          ; count iterations
+    jmp loop
@@ -0,0 +1,24 @@
+; Call/return kernel: nested jsr/ret in a loop.
+; jsr returns past the instruction after it, so every call is followed
+; by a filler instruction that is skipped.
+
+main:
+    ldw a, 0          ; call counter
+    ldw b, 1          ; increment
+
+loop:
+    jsr outer
+    ldw f, 0          ; skipped on return
+    jsr outer
+    ldw f, 0          ; skipped on return
+    jmp loop
+
+outer:
+    add a, b
+    jsr inner
+    ldw f, 0          ; skipped on return
+    ret
+
+inner:
+    add a, b
+    ret
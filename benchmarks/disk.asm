@@ -0,0 +1,23 @@
+; Disk kernel: write every byte of drive 0 with int 0x81 and read it
+; back with int 0x80, sector by sector, forever.
+; The benchmark runs it with an empty drive0.bin in a scratch directory.
+
+main:
+    ldw a, 0          ; drive number
+    ldw b, 0          ; sector number
+    ldw c, 0          ; byte offset
+    ldw f, 255        ; bytes per sector
+
+loop:
+    mov d, c          ; byte to write
+    int 0x81          ; write d to drive a, sector b, offset c
+    int 0x80          ; read it back into e
+    ldw e, 1
+    add c, e          ; next byte
+    bne c, f, loop
+    ldw c, 0
+    add b, e          ; next sector
+    ldw e, 16
+    bne b, e, loop
+    ldw b, 0
+    jmp loop
@@ -0,0 +1,18 @@
+; Stack kernel: push and pop runs in a loop.
+
+main:
+    ldw a, 1
+    ldw b, 2
+    ldw c, 3
+    ldw d, 4
+
+loop:
+    push a
+    push b
+    push c
+    push d
+    pop a             ; reverses the registers every pass
+    pop b
+    pop c
+    pop d
+    jmp loop
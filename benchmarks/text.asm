@@ -0,0 +1,21 @@
+; Text kernel: fill an 800x600 text screen (80 x 37 cells) with
+; characters using int 0x72, over and over.
+
+main:
+    ldw a, 1          ; text mode
+    ldw b, 800        ; horizontal resolution
+    ldw c, 600        ; vertical resolution
+    int 0x70
+    ldw a, 0x41       ; character ('A', wraps through all 256 codes)
+    ldw b, 0          ; cursor position
+    ldw c, 0xFFFFFF   ; white
+    ldw d, 1          ; increment
+    ldw e, 2960       ; number of cells
+
+loop:
+    int 0x72          ; draw character a at cursor b
+    add b, d
+    add a, d
+    bne b, e, loop
+    ldw b, 0
+    jmp loop
@@ -0,0 +1,379 @@
+"""Display backends for the graphics interrupts (0x70 - 0x76) and key input.
+
+HeadlessDisplay keeps the framebuffer and text buffer in memory and never
+opens a window, so the emulator runs on hosts without a display.
+PygameDisplay shows the same buffers in a pygame window; pygame is only
+imported once a window is actually opened.
+
+Bitmap mode pixels live in a NumPy array (see Framebuffer), the window
+only receives the regions that changed, once per frame. Text mode redraws
+only the cell that changed, from a cache of rendered glyphs.
+
+Key input goes to the display's Keyboard (see keyboard.py): the window
+backend feeds it key events from pump(), scripts and tests use press()
+and release() on any backend.
+"""
+
+import struct, zlib
+from array import array
+from collections import OrderedDict
+
+from keyboard import Keyboard
+
+np = None  # NumPy, imported by the first Framebuffer since only bitmap mode needs it
+
+
+BITMAP_MODE = 0
+TEXT_MODE = 1
+
+BLANK_CELL = (0x20, 0xFFFFFF)  # Space and white color
+
+GLYPH_CACHE_SIZE = 512  # rendered (char, color) glyphs kept by the window backend
+MAX_DIRTY_CELLS = 64  # more changed text cells than this in a frame updates the whole window
+MAX_DIRTY_RECTS = 8  # changed bitmap rectangles kept apart per frame, past that they merge into one
+
+
+def _rgb(color):
+    return (color & 0xFF0000) >> 16, (color & 0x00FF00) >> 8, color & 0x0000FF
+
+
+class Framebuffer:
+    """Bitmap mode pixels, a (height, width) uint32 array of 0xRRGGBB.
+    
+    Writes are tracked as a short list of dirty rectangles that the
+    window backend pushes to the screen once per frame. Rectangles that
+    overlap or touch merge, so far apart updates stay separate.
+    """
+
+    def __init__(self, width, height):
+        global np
+        if np is None:
+            import numpy as np
+        self.width = width
+        self.height = height
+        self.pixels = np.zeros((height, width), np.uint32)
+        self.dirty = [(0, 0, width, height)]  # (x0, y0, x1, y1) changed since the last take_dirty()
+
+    def set(self, x, y, color):
+        self.pixels[y, x] = color
+        dirty = self.dirty
+        if dirty:
+            last = dirty[-1]  # the one the previous write went to
+            if last[0] <= x < last[2] and last[1] <= y < last[3]:
+                return
+        self.touch(x, y, x + 1, y + 1)
+
+    def fill(self, color, x, y, width, height):
+        """Fill a rectangle, clipped to the framebuffer."""
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width, self.width), min(y + height, self.height)
+        if x0 >= x1 or y0 >= y1:
+            return
+        self.pixels[y0:y1, x0:x1] = color
+        self.touch(x0, y0, x1, y1)
+
+    def blit(self, words, x, y, width, height):
+        """Copy width*height words (0xRRGGBB, row-major) to the rectangle at x, y."""
+        block = np.asarray(words).reshape(height, width) & 0xFFFFFF
+        self.pixels[y:y + height, x:x + width] = block
+        self.touch(x, y, x + width, y + height)
+
+    def touch(self, x0, y0, x1, y1):
+        """Mark a rectangle as changed, merged with the dirty ones it overlaps or touches."""
+        dirty = self.dirty
+        index = 0
+        while index < len(dirty):
+            a0, b0, a1, b1 = dirty[index]
+            if a0 <= x1 and x0 <= a1 and b0 <= y1 and y0 <= b1:
+                x0, y0, x1, y1 = min(a0, x0), min(b0, y0), max(a1, x1), max(b1, y1)
+                del dirty[index]
+                index = 0  # the grown rectangle may reach ones checked already
+            else:
+                index += 1
+        dirty.append((x0, y0, x1, y1))
+        if len(dirty) > MAX_DIRTY_RECTS:
+            dirty[:] = [(min(rect[0] for rect in dirty), min(rect[1] for rect in dirty),
+                         max(rect[2] for rect in dirty), max(rect[3] for rect in dirty))]
+
+    def take_dirty(self):
+        """Changed rectangles since the last call (an empty list if none), and reset them."""
+        dirty, self.dirty = self.dirty, []
+        return dirty
+
+    def rgb(self):
+        """Pixels as a (height, width, 3) uint8 array."""
+        rgb = np.empty((self.height, self.width, 3), np.uint8)
+        rgb[..., 0] = self.pixels >> 16
+        rgb[..., 1] = self.pixels >> 8
+        rgb[..., 2] = self.pixels
+        return rgb
+
+
+class HeadlessDisplay:
+    """In-memory display with no window."""
+
+    cell_width = 10  # Width of each text cell (in pixels)
+    cell_height = 16  # Height of each text cell (in pixels)
+
+    def __init__(self):
+        self.mode = None  # None until the guest calls int 0x70
+        self.width = 0
+        self.height = 0
+        self.framebuffer = None  # bitmap mode pixels, see Framebuffer
+        self.text_buffer = None  # text mode: rows of (char, color)
+        self.keyboard = Keyboard()  # key state and queued key presses for int 0xF6 / 0xF7
+
+    def init(self, mode, width, height):
+        """Set up bitmap (0) or text (1) mode at width x height pixels."""
+        if mode == BITMAP_MODE:
+            self.framebuffer = Framebuffer(width, height)
+        elif mode == TEXT_MODE:
+            self.max_columns = width // self.cell_width
+            self.max_rows = height // self.cell_height
+            self.text_buffer = [[BLANK_CELL] * self.max_columns for _ in range(self.max_rows)]
+        else:
+            raise ValueError("Invalid display mode")
+        self.mode = mode
+        self.width = width
+        self.height = height
+
+    def set_pixel(self, color, x, y):
+        if self.mode != BITMAP_MODE:  # Ensure it's bitmap mode
+            return
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.framebuffer.set(x, y, color & 0xFFFFFF)
+        else:
+            raise ValueError("Pixel coordinates out of bounds")
+
+    def _check_rect(self, x, y, width, height):
+        if not (width >= 0 and height >= 0 and 0 <= x and x + width <= self.width
+                and 0 <= y and y + height <= self.height):
+            raise ValueError("Rectangle out of bounds")
+
+    def fill_rect(self, color, x, y, width, height):
+        """Fill a rectangle (also used for horizontal and vertical lines)."""
+        if self.mode != BITMAP_MODE:
+            return
+        self._check_rect(x, y, width, height)
+        self.framebuffer.fill(color & 0xFFFFFF, x, y, width, height)
+
+    def blit(self, words, x, y, width, height):
+        """Copy a block of guest memory words (0xRRGGBB, row-major) to the screen."""
+        if self.mode != BITMAP_MODE:
+            return
+        self._check_rect(x, y, width, height)
+        if width and height:
+            self.framebuffer.blit(words, x, y, width, height)
+
+    def set_char(self, char, cursor, color):
+        """Write char at a cursor position (in character cells), returns the (column, row)."""
+        if self.mode != TEXT_MODE:  # Ensure it's text mode
+            return None
+        cells = self.max_columns * self.max_rows
+        if cursor >= cells:  # Ensure cursor position is within bounds
+            cursor = cells - 1
+        column = cursor % self.max_columns
+        row = cursor // self.max_columns
+        self.text_buffer[row][column] = (char, color)
+        return column, row
+
+    # key input for scripts and tests, the window backend also gets real key events
+
+    def press(self, keycode):
+        self.keyboard.key_down(keycode)
+
+    def release(self, keycode=None):
+        """Release a key, or all keys if keycode is None."""
+        if keycode is None:
+            self.keyboard.release_all()
+        else:
+            self.keyboard.key_up(keycode)
+
+    def pressed_key(self):
+        """Key code currently held down (the lowest if several are), or None."""
+        return self.keyboard.current
+
+    def pump(self):
+        """Handle host events between run slices, returns False to stop the CPU."""
+        return True
+
+    def present(self):
+        """Show the current frame."""
+
+    # snapshots, see snapshot.py
+
+    def snapshot(self):
+        """(mode, width, height, contents) with the screen contents as bytes."""
+        if self.mode == BITMAP_MODE:
+            contents = self.framebuffer.pixels.tobytes()
+        elif self.mode == TEXT_MODE:
+            cells = [cell for row in self.text_buffer for cell in row]
+            contents = (bytes(char for char, _ in cells)
+                        + array("I", [color & 0xFFFFFFFF for _, color in cells]).tobytes())
+        else:
+            contents = b""
+        return self.mode, self.width, self.height, contents
+
+    def restore(self, mode, width, height, contents):
+        """Set up the display from snapshot() output."""
+        if mode is None:
+            return
+        self.init(mode, width, height)
+        if mode == BITMAP_MODE:
+            self.framebuffer.pixels[:] = np.frombuffer(contents, np.uint32).reshape(height, width)
+            self.framebuffer.touch(0, 0, width, height)
+        else:
+            count = self.max_columns * self.max_rows
+            colors = array("I", contents[count:])
+            for cursor in range(count):
+                if (contents[cursor], colors[cursor]) != BLANK_CELL:
+                    self.set_char(contents[cursor], cursor, colors[cursor])
+
+    # dumps
+
+    def raw(self):
+        """Raw contents: RGB bytes (bitmap) or (char, R, G, B) per cell (text)."""
+        if self.mode == BITMAP_MODE:
+            return self.framebuffer.rgb().tobytes()
+        if self.mode == TEXT_MODE:
+            return b"".join(bytes((char & 0xFF,) + _rgb(color))
+                            for row in self.text_buffer for char, color in row)
+        return b""
+
+    def text(self):
+        """Text mode contents as lines of characters."""
+        return "\n".join("".join(chr(char) for char, _ in row) for row in self.text_buffer or [])
+
+    def _bitmap(self):
+        """RGB bytes of the framebuffer, raises ValueError outside bitmap mode."""
+        if self.mode != BITMAP_MODE:
+            raise ValueError("Display is not in bitmap mode")
+        return self.raw()
+
+    def save_ppm(self, path):
+        """Write the bitmap framebuffer as a binary PPM (P6) image."""
+        rgb = self._bitmap()
+        with open(path, "wb") as f:
+            f.write(b"P6\n%d %d\n255\n" % (self.width, self.height))
+            f.write(rgb)
+
+    def save_png(self, path):
+        """Write the bitmap framebuffer as a PNG image."""
+        rgb = self._bitmap()
+        stride = 3 * self.width
+        # every scanline starts with filter type 0 (none)
+        scanlines = b"".join(b"\x00" + rgb[y * stride:(y + 1) * stride] for y in range(self.height))
+
+        def chunk(kind, data):
+            return (struct.pack(">I", len(data)) + kind + data
+                    + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+        with open(path, "wb") as f:
+            f.write(b"\x89PNG\r\n\x1a\n")
+            f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", self.width, self.height, 8, 2, 0, 0, 0)))
+            f.write(chunk(b"IDAT", zlib.compress(scanlines)))
+            f.write(chunk(b"IEND", b""))
+
+
+class GlyphCache:
+    """Rendered glyph surfaces keyed by (char, color), least recently used evicted first."""
+
+    def __init__(self, font, size=GLYPH_CACHE_SIZE):
+        self.font = font
+        self.size = size
+        self.glyphs = OrderedDict()
+
+    def get(self, char, color):
+        key = (char, color)
+        glyph = self.glyphs.get(key)
+        if glyph is not None:
+            self.glyphs.move_to_end(key)
+            return glyph
+        glyph = self.font.render(chr(char), True, _rgb(color))
+        self.glyphs[key] = glyph
+        if len(self.glyphs) > self.size:
+            self.glyphs.popitem(last=False)
+        return glyph
+
+
+class PygameDisplay(HeadlessDisplay):
+    """Shows the display in a pygame window."""
+
+    def __init__(self):
+        super().__init__()
+        self.pygame = None  # imported when the window is opened
+        self.screen = None
+
+    def _import_pygame(self):
+        if self.pygame is None:
+            import pygame
+            self.pygame = pygame
+        return self.pygame
+
+    def init(self, mode, width, height):
+        super().init(mode, width, height)
+        pygame = self._import_pygame()
+        pygame.init()
+        if mode == TEXT_MODE:
+            self.font = pygame.font.Font(pygame.font.get_default_font(), self.cell_height)
+            self.glyphs = GlyphCache(self.font)
+            self.dirty_cells = []  # cell rectangles redrawn since the last present()
+        self.screen = pygame.display.set_mode((width, height), 0, 32)
+        self.screen.fill((0, 0, 0))  # Black background
+        pygame.display.set_caption("Bitmap Mode" if mode == BITMAP_MODE else "Text Mode")
+
+    def set_char(self, char, cursor, color):
+        cell = super().set_char(char, cursor, color)
+        if cell is None:
+            return None
+
+        # Redraw just this cell, the window is updated in present()
+        column, row = cell
+        rect = (column * self.cell_width, row * self.cell_height, self.cell_width, self.cell_height)
+        self.screen.fill((0, 0, 0), rect)
+        self.screen.blit(self.glyphs.get(char, color), rect[:2], (0, 0, self.cell_width, self.cell_height))
+        if len(self.dirty_cells) <= MAX_DIRTY_CELLS:  # past that present() updates everything
+            self.dirty_cells.append(rect)
+        return cell
+
+    def pump(self):
+        if self.screen:
+            pygame = self.pygame
+            keyboard = self.keyboard
+            for event in pygame.event.get():
+                if event.type == pygame.KEYDOWN:
+                    keyboard.key_down(event.key)
+                elif event.type == pygame.KEYUP:
+                    keyboard.key_up(event.key)
+                elif event.type == pygame.WINDOWFOCUSLOST:  # the key ups go to another window
+                    keyboard.release_all()
+                elif event.type == pygame.QUIT:
+                    return False
+        return True
+
+    def present(self):
+        if not self.screen:
+            return
+        if self.mode == TEXT_MODE:
+            if len(self.dirty_cells) > MAX_DIRTY_CELLS:
+                self.pygame.display.update()
+            elif self.dirty_cells:
+                self.pygame.display.update(self.dirty_cells)
+            self.dirty_cells = []
+            return
+        
+        # copy only the changed rectangles of the framebuffer to the window
+        dirty = self.framebuffer.take_dirty()
+        if not dirty:
+            return
+        surface = self.pygame.surfarray.pixels3d(self.screen)  # view of the screen, locks it
+        for x0, y0, x1, y1 in dirty:
+            pixels = self.framebuffer.pixels[y0:y1, x0:x1].T  # surfarray indexes (x, y)
+            surface[x0:x1, y0:y1, 0] = pixels >> 16
+            surface[x0:x1, y0:y1, 1] = pixels >> 8
+            surface[x0:x1, y0:y1, 2] = pixels
+        del surface  # unlock before updating the display
+        self.pygame.display.update([(x0, y0, x1 - x0, y1 - y0) for x0, y0, x1, y1 in dirty])
+
+
+DISPLAYS = {"window": PygameDisplay, "headless": HeadlessDisplay}
@@ -0,0 +1,205 @@
+"""Disk drives for the disk interrupts (0x80 - 0x84).
+
+Bytes are moved one at a time (0x80/0x81) or a run of whole sectors at a
+time between a drive and guest memory (0x82/0x83).
+
+Every drive is a local file, drive{N}.bin, opened and memory-mapped the
+first time the guest touches it and served from the mapping after that.
+Writes only mark the drive dirty, dirty drives are flushed to disk on
+sync(), every flush_interval seconds (see poll()) and on close().
+
+Files shorter than a full drive read as short (error 0x85 past the end).
+The first write past the end grows the file to a full drive, close()
+trims it back to the last byte written. Files the host can't write to
+are mapped read-only, writes to them fail with error 0x86.
+"""
+
+import errno, mmap, os, time
+
+
+DRIVE_COUNT = 10  # drive numbers 0 to 9
+SECTOR_COUNT = 16  # sectors per drive
+SECTOR_SIZE = 255  # bytes per sector
+DRIVE_SIZE = SECTOR_COUNT * SECTOR_SIZE
+
+FLUSH_INTERVAL = 1.0  # seconds between flushes of dirty drives
+
+# error codes reported to the guest in register A
+INVALID_DRIVE = 0x81
+INVALID_SECTOR = 0x82
+INVALID_OFFSET = 0x83
+DRIVE_NOT_FOUND = 0x84
+READ_FAILED = 0x85
+WRITE_FAILED = 0x86
+
+
+class DriveError(Exception):
+    """Disk access the guest has to be told about, code is one of the error codes above."""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+def check_address(number, sector, offset):
+    """Validate a drive, sector, offset address, raises DriveError."""
+    if not 0 <= number < DRIVE_COUNT:
+        raise DriveError(INVALID_DRIVE, f"Invalid drive number: {number}")
+    if not 0 <= sector < SECTOR_COUNT:
+        raise DriveError(INVALID_SECTOR, f"Invalid sector number: {sector}")
+    if not 0 <= offset < SECTOR_SIZE:
+        raise DriveError(INVALID_OFFSET, f"Invalid byte offset: {offset}")
+
+
+def check_sectors(number, sector, count):
+    """Validate a run of count sectors starting at sector, raises DriveError."""
+    if not 0 <= number < DRIVE_COUNT:
+        raise DriveError(INVALID_DRIVE, f"Invalid drive number: {number}")
+    if not (0 <= sector < SECTOR_COUNT and 0 <= count <= SECTOR_COUNT - sector):
+        raise DriveError(INVALID_SECTOR, f"Invalid sectors: {sector} to {sector + count - 1}")
+
+
+class Drive:
+    """One open drive file and its memory mapping."""
+
+    def __init__(self, path):
+        self.path = path
+        self.writable = True
+        try:
+            self.file = open(path, "r+b")
+        except OSError as e:
+            if e.errno not in (errno.EACCES, errno.EPERM, errno.EROFS):
+                raise
+            self.file = open(path, "rb")  # read-only drive
+            self.writable = False
+        self.size = os.fstat(self.file.fileno()).st_size  # bytes the guest can read
+        self.map = None
+        if self.size:
+            access = mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ
+            self.map = mmap.mmap(self.file.fileno(), min(self.size, DRIVE_SIZE), access=access)
+        self.grown = False  # file was extended to DRIVE_SIZE, trim it on close
+        self.dirty = False
+
+    def read(self, position):
+        if position >= self.size:
+            raise DriveError(READ_FAILED, f"Failed to read byte {position} of {self.path}")
+        return self.map[position]
+
+    def read_block(self, position, length):
+        if position + length > self.size:
+            raise DriveError(READ_FAILED, f"Failed to read {length} bytes at {position} of {self.path}")
+        return self.map[position:position + length]
+
+    def _check_writable(self):
+        if not self.writable:
+            raise DriveError(WRITE_FAILED, f"Drive file is read-only: {self.path}")
+
+    def write(self, position, value):
+        self._check_writable()
+        if self.map is None or position >= len(self.map):
+            self._grow()
+        self.map[position] = value
+        if position >= self.size:
+            self.size = position + 1
+        self.dirty = True
+
+    def write_block(self, position, data):
+        self._check_writable()
+        end = position + len(data)
+        if self.map is None or end > len(self.map):
+            self._grow()
+        self.map[position:end] = data
+        if end > self.size:
+            self.size = end
+        self.dirty = True
+
+    def _grow(self):
+        """Extend the file to a full drive and map all of it."""
+        if self.map is not None:
+            self.map.close()
+        self.file.truncate(DRIVE_SIZE)
+        self.map = mmap.mmap(self.file.fileno(), DRIVE_SIZE)
+        self.grown = True
+
+    def flush(self):
+        if self.dirty:
+            self.map.flush()
+            self.dirty = False
+
+    def close(self):
+        self.flush()
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.grown:
+            self.file.truncate(self.size)
+        self.file.close()
+
+
+class DriveSet:
+    """The drives the CPU can see, opened on first use."""
+
+    def __init__(self, directory=".", flush_interval=FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.drives = {}  # drive number -> Drive
+        self.last_flush = time.monotonic()
+
+    def path(self, number):
+        """File backing a drive number."""
+        return os.path.join(self.directory, f"drive{number}.bin")
+
+    def drive(self, number):
+        """Open drive number, raises DriveError if it has no file."""
+        drive = self.drives.get(number)
+        if drive is None:
+            path = self.path(number)
+            if not os.path.exists(path):
+                raise DriveError(DRIVE_NOT_FOUND, f"Drive file not found: {path}")
+            drive = self.drives[number] = Drive(path)
+        return drive
+
+    def read_byte(self, number, sector, offset):
+        check_address(number, sector, offset)
+        return self.drive(number).read(sector * SECTOR_SIZE + offset)
+
+    def write_byte(self, number, sector, offset, value):
+        check_address(number, sector, offset)
+        self.drive(number).write(sector * SECTOR_SIZE + offset, value)
+
+    def read_sectors(self, number, sector, count):
+        """count whole sectors starting at sector, as bytes."""
+        check_sectors(number, sector, count)
+        if count == 0:
+            return b""
+        return self.drive(number).read_block(sector * SECTOR_SIZE, count * SECTOR_SIZE)
+
+    def check_transfer(self, number, sector, count):
+        """Validate a run of sectors and open its drive before anything is copied, raises DriveError."""
+        check_sectors(number, sector, count)
+        self.drive(number)
+
+    def write_sectors(self, number, sector, data):
+        """Write whole sectors starting at sector, data is a multiple of SECTOR_SIZE bytes."""
+        count = len(data) // SECTOR_SIZE
+        check_sectors(number, sector, count)
+        if count:
+            self.drive(number).write_block(sector * SECTOR_SIZE, data)
+
+    def sync(self):
+        """Flush every dirty drive to disk."""
+        for drive in self.drives.values():
+            drive.flush()
+        self.last_flush = time.monotonic()
+
+    def poll(self):
+        """Flush if flush_interval has passed, called between run slices."""
+        if self.flush_interval is not None and time.monotonic() - self.last_flush >= self.flush_interval:
+            self.sync()
+
+    def close(self):
+        """Flush and close all drives, they are reopened on next use."""
+        for drive in self.drives.values():
+            drive.close()
+        self.drives.clear()
+        self.last_flush = time.monotonic()
@@ -0,0 +1,175 @@
+"""Macro-op fusion for the interpreter loop.
+
+The decoder hands the run loop a single entry for some instruction
+sequences, saving the fetch and dispatch round trip for all but the
+first instruction:
+
+    pairs  the opcode pairs in FUSED_PAIRS, the first one from FIRST
+           (register-only instructions that can't fault or jump)
+    runs   up to MAX_INSTRUCTIONS pushes or pops in a row
+
+A fused pair runs its first instruction inline and the second through
+its normal handler, runs call the handler for every instruction. Every
+instruction still counts a cycle, and faults leave the PC and cycle
+count where they'd be without fusion. Only the plain interpreter loop uses fused
+entries, the profiler, tracer and basic-block compiler see every
+instruction on its own.
+
+FUSED_PAIRS holds the fusable pairs that make up 1% or more of the
+instructions executed by the benchmark corpus (per program, averaged)
+in the profiler's pair counts, and at least PROGRAM_SHARE of the
+instructions of MIN_PROGRAMS programs or more. A pair common in a
+single kernel only (benchmarks/alu.asm alone brings six) isn't fused,
+the table would fit that kernel rather than programs. To measure again:
+
+    python fusion.py [program.asm ...]
+"""
+
+import contextlib, io, operator, os, sys, tempfile
+
+
+MAX_INSTRUCTIONS = 6  # longest push / pop run, the run loop keeps this much budget to spare
+MAX_LENGTH = 3 * MAX_INSTRUCTIONS  # in words
+
+FIRST = {0x01, 0x02, 0x03, 0x04, 0x0F, 0x10, 0x12}  # ldw mov add sub xor and mul
+RUNS = {0x0B, 0x0C}  # push pop
+ARITHMETIC = {0x03: operator.add, 0x04: operator.sub, 0x0F: operator.xor, 0x10: operator.and_, 0x12: operator.mul}
+
+MIN_SHARE = 0.01  # of all instructions, averaged over the programs
+PROGRAM_SHARE = 0.005  # of one program's instructions, for it to count towards MIN_PROGRAMS
+MIN_PROGRAMS = 2
+
+FUSED_PAIRS = {
+    (0x03, 0x08),  # add+bne   6.2%  3 programs
+    (0x03, 0x03),  # add+add   4.1%  2 programs
+    (0x02, 0x0A),  # mov+int   3.9%  2 programs
+    (0x01, 0x03),  # ldw+add   3.0%  2 programs
+}
+
+CORPUS = ["gradiant.asm", "example.asm", "main.asm", "benchmarks/alu.asm", "benchmarks/calls.asm",
+          "benchmarks/stack.asm", "benchmarks/disk.asm", "benchmarks/text.asm"]
+CYCLES = 200000  # instructions profiled per program
+
+
+def _pair(cpu, first, second):
+    opcode, (a, b) = first[3], first[1]
+    regs = cpu.regs
+    handler, operands = second[0], second[1]
+
+    # the first instruction inlined, same as its CPU handler
+    if opcode == 0x01:  # ldw
+        def fused():
+            regs[a] = b
+            cpu.cycles += 1
+            handler(*operands)
+    elif opcode == 0x02:  # mov
+        def fused():
+            regs[a] = regs[b]
+            cpu.cycles += 1
+            handler(*operands)
+    else:
+        operation = ARITHMETIC[opcode]
+
+        def fused():
+            regs[a] = operation(regs[a], regs[b])
+            cpu.cycles += 1
+            handler(*operands)
+    return fused
+
+
+def _run(cpu, handler, operands, start):
+    last = len(operands) - 1
+
+    def fused():
+        for index, registers in enumerate(operands):
+            try:
+                handler(*registers)
+            except Exception:
+                cpu.cycles += index
+                cpu.PC = start + 3 * (index + 1)  # after the instruction that faulted
+                raise
+        cpu.cycles += last
+    return fused
+
+
+def fuse(cpu, addr, first):
+    """The run loop entry for addr: a fused entry, or first (the decoded instruction at addr)."""
+    opcode = first[3]
+    if first[0] is not cpu._dispatch.get(opcode, (None,))[0]:  # unknown opcode or checked at decode
+        return first
+
+    if opcode in RUNS:
+        instructions = [first]
+        following = addr + 3
+        while len(instructions) < MAX_INSTRUCTIONS and following < len(cpu.memory):
+            instruction = cpu._decoded.get(following) or cpu._decode(following)
+            if instruction[3] != opcode or instruction[0] is not first[0]:
+                break
+            instructions.append(instruction)
+            following += 3
+        if len(instructions) == 1:
+            return first
+        handler = _run(cpu, first[0], [instruction[1] for instruction in instructions], addr)
+        return handler, (), following - addr, opcode
+
+    if opcode not in FIRST or addr + 3 >= len(cpu.memory):
+        return first
+    second = cpu._decoded.get(addr + 3) or cpu._decode(addr + 3)
+    if (opcode, second[3]) not in FUSED_PAIRS or second[0] is not cpu._dispatch[second[3]][0]:
+        return first
+    return _pair(cpu, first, second), (), 3 + second[2], second[3]  # only the second can fault
+
+
+def measure(programs, cycles=CYCLES):
+    """Profile programs, returns {(first, second): (share, programs)}.
+
+    share is averaged over the programs, programs counts those the pair
+    makes up PROGRAM_SHARE or more of.
+    """
+    from assembler import assemble_file
+    from drives import DriveSet
+    from main import CPU
+    from profiler import SLOTS
+
+    shares = {}
+    for path in programs:
+        with tempfile.TemporaryDirectory() as directory:
+            open(os.path.join(directory, "drive0.bin"), "wb").close()  # for the disk kernel
+            cpu = CPU(display="headless", drives=DriveSet(directory), profile=True)
+            cpu.load_program(assemble_file(path, cache_dir=None))
+            with contextlib.redirect_stdout(io.StringIO()):
+                cpu.run(max_cycles=cycles)
+        pairs = cpu.profiler.pairs
+        total = sum(pairs) or 1
+        for index, count in enumerate(pairs):
+            if count:
+                pair = divmod(index, SLOTS)
+                share, count_in = shares.get(pair, (0, 0))
+                shares[pair] = (share + count / total / len(programs),
+                                count_in + (count / total >= PROGRAM_SHARE))
+    return shares
+
+
+def main(argv=None):
+    from profiler import OPCODE_NAMES
+    here = os.path.dirname(os.path.abspath(__file__))
+    programs = (sys.argv[1:] if argv is None else argv) or [os.path.join(here, path) for path in CORPUS]
+    shares = measure(programs)
+    print("Fusable pairs by share of executed instructions:")
+    for (first, second), (share, count) in sorted(shares.items(), key=lambda item: -item[1][0]):
+        if first in FIRST and share >= 0.001:
+            if (first, second) in FUSED_PAIRS:
+                state = "fused"
+            elif share >= MIN_SHARE and count >= MIN_PROGRAMS:
+                state = "candidate"
+            else:
+                state = ""
+            print(f"   ({first:#04x}, {second:#04x}),  # {OPCODE_NAMES.get(first, '?')}+"
+                  f"{OPCODE_NAMES.get(second, '?'):<5} {share:6.1%}  {count} programs  {state}")
+    runs = sum(share for (first, second), (share, _) in shares.items() if first == second and first in RUNS)
+    print(f"push / pop runs: {runs:.1%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
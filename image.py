@@ -0,0 +1,112 @@
+"""Binary program images.
+
+An image is a little-endian file holding machine code ready to load:
+
+    header     magic, format version, word size (bytes), entry PC,
+               section count, CRC-32 of everything after the header
+    sections   per section: load address, length in words, kind
+               (code or data)
+    data       the raw words of every section in table order, each
+               padded to a multiple of 8 bytes
+
+CPU.load_program maps the file and copies the sections straight into
+guest memory, nothing is parsed, so loading costs one copy of the words.
+
+    python asm-to-prg.py main.asm -o main.img
+    python main.py main.img
+"""
+
+import mmap, struct, zlib
+from array import array
+from collections import namedtuple
+
+from memory import WORD_TYPES, word_mask
+
+
+MAGIC = b"PY502IMG"
+VERSION = 1
+EXTENSION = ".img"
+
+HEADER = struct.Struct("<8sHB5xQII")  # magic, version, word size, entry, section count, CRC-32
+SECTION = struct.Struct("<QQB7x")  # load address, words, kind
+
+CODE = 0
+DATA = 1
+
+Section = namedtuple("Section", "address kind words")
+Image = namedtuple("Image", "word_size entry sections")
+
+
+def _padding(size):
+    return -size % 8
+
+
+def save(f, sections, entry=0, word_size=8):
+    """Write an image to the binary file object f.
+
+    sections is a list of Sections, their words any sequence of ints.
+    """
+    typecode = WORD_TYPES[word_size]
+    mask = word_mask(word_size)  # narrow words wrap like CPU stores
+    table = b""
+    data = []
+    for section in sections:
+        words = array(typecode, [word & mask for word in section.words]).tobytes()
+        table += SECTION.pack(section.address, len(words) // word_size, section.kind)
+        data.append(words + bytes(_padding(len(words))))
+    body = table + b"".join(data)
+    f.write(HEADER.pack(MAGIC, VERSION, word_size, entry, len(sections), zlib.crc32(body)))
+    f.write(body)
+
+
+def read(buffer):
+    """Parse an image in buffer (bytes, mmap, ...), returns an Image.
+
+    The section words are memoryviews into buffer, release them before
+    closing it.
+    """
+    with memoryview(buffer) as view:  # released on errors too, so buffer can close
+        if len(view) < HEADER.size:
+            raise ValueError("Image is truncated")
+        magic, version, word_size, entry, count, crc = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError("Not a program image")
+        if version != VERSION:
+            raise ValueError(f"Unsupported image version: {version}")
+        if word_size not in WORD_TYPES:
+            raise ValueError(f"Unsupported word size: {word_size}")
+        offset = HEADER.size + count * SECTION.size
+        if offset > len(view):
+            raise ValueError("Image is truncated")
+        if zlib.crc32(view[HEADER.size:]) != crc:
+            raise ValueError("Image checksum mismatch")
+
+        table = []
+        for index in range(count):
+            address, length, kind = SECTION.unpack_from(view, HEADER.size + index * SECTION.size)
+            size = length * word_size
+            if offset + size > len(view):
+                raise ValueError("Image is truncated")
+            table.append((address, kind, offset, size))
+            offset += size + _padding(size)
+
+        typecode = WORD_TYPES[word_size]
+        sections = [Section(address, kind, view[start:start + size].cast(typecode))
+                    for address, kind, start, size in table]
+    return Image(word_size, entry, sections)
+
+
+def load(cpu, path):
+    """Map the image at path into cpu's memory and set the PC to its entry point."""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        image = read(mapped)
+        try:
+            for section in image.sections:
+                words = section.words
+                if image.word_size != cpu.word_size:
+                    words = words.tolist()  # converted and wrapped like any list of words
+                cpu.load_program(words, section.address)
+        finally:
+            for section in image.sections:
+                section.words.release()  # the map can't close while views are exported
+    cpu.PC = image.entry
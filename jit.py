@@ -0,0 +1,208 @@
+"""Basic-block compiler for the CPU.
+
+Straight-line guest code up to the next branch, jump, call, return or
+interrupt is turned into one Python function that keeps the registers in
+locals. Results (registers, memory, stack, PC and cycle count) match the
+interpreter instruction for instruction, including when an instruction
+faults half way through a block.
+"""
+
+from profiler import REGISTER_NAMES
+
+
+# opcodes that end a basic block
+BLOCK_END = {0x00, 0x08, 0x09, 0x0A, 0x0D, 0x0E, 0x11, 0x14}
+
+MAX_BLOCK_INSTRUCTIONS = 64
+
+def _decode(cpu, addr, opcodes):
+    """Raw (opcode, operands, length) at addr, padded like CPU.fetch."""
+    memory = cpu.memory
+    opcode = memory[addr]
+    info = opcodes.get(opcode)
+    length = info[1] if info else 3
+    operands = tuple(memory[addr + 1:addr + length])
+    if len(operands) < length - 1:
+        operands += (0,) * (length - 1 - len(operands))
+    return opcode, operands, length
+
+
+def _reg(code):
+    """Local name for a register code, None if the code is invalid."""
+    if type(code) is int and 0 <= code < len(REGISTER_NAMES):
+        return REGISTER_NAMES[code]
+    return None
+
+
+def compile_block(cpu, start, opcodes):
+    """Compile the block starting at start, returns (function, end address)."""
+    memory_size = len(cpu.memory)
+    stack_size = len(cpu.stack)
+    wrap = f" & {cpu.word_mask}" if cpu.word_mask != -1 else ""  # narrow words wrap like CPU stores
+
+    # decode the block first so stores can tell if they hit it
+    instructions = []
+    addr = start
+    while addr < memory_size and len(instructions) < MAX_BLOCK_INSTRUCTIONS:
+        opcode, operands, length = _decode(cpu, addr, opcodes)
+        instructions.append((addr, opcode, operands, length))
+        addr += length
+        if opcode in BLOCK_END or opcode not in opcodes:
+            break
+    end = addr
+
+    body = []       # statements inside the try block
+    tail = []       # statements after the registers are written back
+    reads = set()   # registers loaded into locals
+    writes = set()  # registers written back at the end
+    uses_memory = uses_stack = False
+    next_pc = end
+    ends = []       # PC after each instruction, for faults
+    ops = []        # opcode of each instruction, for faults
+    count = len(instructions)
+
+    def read(code):
+        name = _reg(code)
+        reads.add(name)
+        return name
+
+    def write(code):
+        name = _reg(code)
+        reads.add(name)  # keep the old value if a later fault skips the write
+        writes.add(name)
+        return name
+
+    for index, (addr, opcode, operands, length) in enumerate(instructions):
+        pc_after = addr + length
+        ends.append(pc_after)
+        ops.append(opcode)
+        a, b = operands[0], operands[1]
+        emit = body.append
+        fault = f"i = {index}"
+
+        # same check as CPU._decode, before the instruction has any effect
+        register_count = opcodes[opcode][2] if opcode in opcodes else 0
+        bad = [reg for reg in operands[:register_count] if _reg(reg) is None]
+        if bad:
+            emit(fault)
+            emit(f"raise ValueError('Invalid register: {bad[0]}')")
+            break
+
+        if opcode == 0x00:  # halt
+            tail.append("cpu.running = False")
+        elif opcode == 0x01:  # ldw
+            emit(f"{write(a)} = {b!r}")
+        elif opcode == 0x02:  # mov
+            emit(f"{write(a)} = {read(b)}")
+        elif opcode in (0x03, 0x04, 0x0F, 0x10, 0x12):  # add, sub, xor, and, mul
+            symbol = {0x03: "+", 0x04: "-", 0x0F: "^", 0x10: "&", 0x12: "*"}[opcode]
+            emit(f"{write(a)} = {read(a)} {symbol} {read(b)}")
+        elif opcode == 0x13:  # div
+            emit(fault)
+            emit(f"if {read(b)} == 0: raise ZeroDivisionError('Divided by 0')")
+            emit(f"{write(a)} = {read(a)} // {read(b)}")
+        elif opcode in (0x05, 0x06):  # str, ldr
+            if type(b) is not int or not 0 <= b < memory_size:
+                emit(fault)
+                emit("raise ValueError('Invalid memory address.')")
+                break
+            uses_memory = True
+            if opcode == 0x06:
+                emit(f"{write(a)} = memory[{b}]")
+                continue
+            emit(fault)
+            emit(f"memory[{b}] = {read(a)}{wrap}")
+            if start <= b < end:
+                # the block overwrote itself, leave before running stale code
+                emit(f"cpu._invalidate({b})")
+                emit("raise _Leave")
+                break
+            emit(f"if {b} < cpu._decoded_end: cpu._invalidate({b})")
+        elif opcode == 0x0B:  # push
+            uses_stack = True
+            emit(fault)
+            emit("SP -= 1")
+            emit("if SP < 0: raise OverflowError('Stack overflow')")
+            emit(f"stack[SP] = {read(a)}{wrap}")
+        elif opcode == 0x0C:  # pop
+            uses_stack = True
+            emit(fault)
+            emit(f"if SP >= {stack_size}: raise OverflowError('Stack underflow')")
+            emit(f"{write(a)} = stack[SP]")
+            emit("stack[SP] = 0")
+            emit("SP += 1")
+        elif opcode == 0x0D:  # jsr
+            uses_stack = True
+            emit(fault)
+            emit("SP -= 1")
+            emit("if SP < 0: raise OverflowError('Stack overflow')")
+            emit(f"stack[SP] = {(pc_after + 3) & cpu.word_mask}")
+            next_pc = a
+        elif opcode == 0x0E:  # ret
+            uses_stack = True
+            emit(fault)
+            emit(f"if SP >= {stack_size}: raise OverflowError('Stack underflow')")
+            emit("pc = stack[SP]")
+            emit("stack[SP] = 0")
+            emit("SP += 1")
+            next_pc = None
+        elif opcode == 0x11:  # jmp
+            next_pc = a
+        elif opcode in (0x08, 0x09, 0x14):  # bne, beq, blt
+            c = operands[2]
+            compare = {0x08: "!=", 0x09: "==", 0x14: "<"}[opcode]
+            condition = f"{read(a)} {compare} {read(b)}"
+            if opcode != 0x09 and not 0 <= c < memory_size:
+                emit(fault)
+                emit(f"if {condition}: raise ValueError('Invalid branch target address: {c}')")
+            else:
+                emit(f"pc = {c!r} if {condition} else {pc_after}")
+                next_pc = None
+        elif opcode == 0x0A:  # int, runs after the registers are written back
+            tail.append(f"cpu._fault_opcode = {opcode}")
+            tail.append(f"cpu._int({a!r}, {b!r})")
+        else:
+            emit(fault)
+            emit(f"raise ValueError('Unknown opcode: {opcode}')")
+            break
+
+    reads.discard(None)
+    writes.discard(None)
+    lines = ["def block(cpu):"]
+    if reads:
+        lines.append("    regs = cpu.regs")
+    lines += [f"    {name} = regs[{REGISTER_NAMES.index(name)}]" for name in sorted(reads)]
+    if uses_memory:
+        lines.append("    memory = cpu.memory")
+    if uses_stack:
+        lines += ["    stack = cpu.stack", "    SP = cpu.SP"]
+    lines.append("    i = 0")
+    lines.append("    try:")
+    lines += [f"        {line}" for line in body] or ["        pass"]
+
+    writeback = [f"regs[{REGISTER_NAMES.index(name)}] = {name}" for name in sorted(writes)]
+    if uses_stack:
+        writeback.append("cpu.SP = SP")
+    lines.append("    except _Leave:")
+    lines += [f"        {line}" for line in writeback]
+    lines.append("        cpu.cycles += i + 1")
+    lines.append("        cpu.PC = ENDS[i]")
+    lines.append("        return")
+    lines.append("    except BaseException:")
+    lines += [f"        {line}" for line in writeback]
+    lines.append("        cpu.cycles += i + 1")
+    lines.append("        cpu.PC = ENDS[i]")
+    lines.append("        cpu._fault_opcode = OPS[i]")
+    lines.append("        raise")
+    lines += [f"    {line}" for line in writeback]
+    lines.append(f"    cpu.cycles += {count}")
+    lines.append(f"    cpu.PC = {'pc' if next_pc is None else repr(next_pc)}")
+    lines += [f"    {line}" for line in tail]
+
+    namespace = {"ENDS": tuple(ends), "OPS": tuple(ops), "_Leave": _Leave}
+    exec(compile("\n".join(lines), f"<block 0x{start:04X}>", "exec"), namespace)
+    return namespace["block"], end
+
+
+class _Leave(Exception):
+    """Raised by a block that stored into its own code."""
@@ -0,0 +1,40 @@
+"""Keyboard device for the key interrupts (0xF6, 0xF7).
+
+The display backend feeds key down / key up events into a Keyboard from
+its event pump (or press() / release() when headless). The device keeps
+the keys held down, the current key for int 0xF6, and a bounded queue of
+key presses for int 0xF7, so neither interrupt has to look at the host.
+"""
+
+from collections import deque
+
+
+KEY_BUFFER_SIZE = 32  # queued key presses, the oldest are dropped when full
+
+
+class Keyboard:
+    def __init__(self, size=KEY_BUFFER_SIZE):
+        self.held = set()  # key codes held down
+        self.current = None  # key reported by int 0xF6: lowest held key code, or None
+        self.buffer = deque(maxlen=size)  # key presses not yet read by int 0xF7
+
+    def key_down(self, keycode):
+        if keycode in self.held:  # auto repeat
+            return
+        self.held.add(keycode)
+        self.buffer.append(keycode)
+        if self.current is None or keycode < self.current:
+            self.current = keycode
+
+    def key_up(self, keycode):
+        self.held.discard(keycode)
+        if keycode == self.current:
+            self.current = min(self.held) if self.held else None
+
+    def release_all(self):
+        self.held.clear()
+        self.current = None
+
+    def next_key(self):
+        """Oldest queued key press, or None."""
+        return self.buffer.popleft() if self.buffer else None
@@ -1,34 +1,109 @@
-import pygame, time, os
+import time, os, operator, argparse, ast
+from array import array
+from functools import partial
+
+import assembler, fusion, image, jit, snapshot
+from display import DISPLAYS
+from drives import DriveSet, DriveError, SECTOR_SIZE
+from memory import PagedMemory, DENSE_LIMIT, PAGE_BITS, PAGE_MASK, PAGE_SIZE, WORD_TYPES, word_mask
+from profiler import Profiler, REGISTER_NAMES
+from tracer import Tracer, TRACE_SIZE, TRACE_DUMP
+
+
+# opcode -> (handler, instruction length, register operands)
+OPCODES = {
+    0x00: ("_halt", 3, 0),   # Halt
+    0x01: ("_load", 3, 1),   # LOAD
+    0x02: ("_mov", 3, 2),    # MOV
+    0x03: ("_add", 3, 2),    # ADD
+    0x04: ("_sub", 3, 2),    # SUB
+    0x05: ("_store", 3, 1),  # STORE
+    0x06: ("_loadm", 3, 1),  # LOADM
+    0x08: ("_bne", 4, 2),    # BNE (Branch if Not Equal)
+    0x09: ("_beq", 4, 2),    # BEQ (Branch if Equal)
+    0x0A: ("_int", 3, 0),    # int interupt handler
+    0x0B: ("_push", 3, 1),   # push stack
+    0x0C: ("_pop", 3, 1),    # pop stack
+    0x0D: ("_jsr", 3, 0),    # jump to subroutine
+    0x0E: ("_ret", 3, 0),    # return from subroutine
+    0x0F: ("_xor", 3, 2),    # xor
+    0x10: ("_and", 3, 2),    # and
+    0x11: ("_jmp", 3, 0),    # jmp
+    0x12: ("_mul", 3, 2),    # mul
+    0x13: ("_div", 3, 2),    # div
+    0x14: ("_blt", 4, 2),    # BLT (Branch if Less Than)
+}
+
+FRAME_RATE = 60  # host frames per second (display updates, paced run modes)
+SLICE_INSTRUCTIONS = 10000  # instructions between host event polls when uncapped
+
+MAX_INSTRUCTION_LENGTH = 4
+
+# branches that fault when taken to an address outside memory
+CHECKED_BRANCHES = {0x08: operator.ne, 0x14: operator.lt}
+
+
+def _register(index):
+    """Named view (cpu.A, cpu.B, ...) onto the indexed register file."""
+    def get(self):
+        return self.regs[index]
+    def set(self, value):
+        self.regs[index] = value
+    return property(get, set)
+
 
 class CPU:
-    def __init__(self, memory_size=256):
+    A = _register(0)
+    B = _register(1)
+    C = _register(2)
+    D = _register(3)
+    E = _register(4)
+    F = _register(5)
+    
+    def __init__(self, memory_size=256, jit=False, word_size=8, display="window", drives=None, profile=False,
+                 fuse=True, paged=None):
         stack_size = 32
-        self.memory = [0] * memory_size  # Fixed-size memory
-        self.stack = [0] * stack_size
+        self.memory = self.stack = None
+        # memories over DENSE_LIMIT words are sparse (see memory.py) unless paged says otherwise
+        self._resize(memory_size, word_size, stack_size, paged)
         self.SP = len(self.stack)  # Stack grows downward
         self.PC = 0x00  # Program Counter
-        self.A = 0 # Register A
-        self.B = 0 # Register B
-        self.C = 0 # Register C
-        self.D = 0 # Register D
-        self.E = 0 # Register E   
-        self.F = 0 # Register F 
+        self.regs = [0] * len(REGISTER_NAMES)  # Registers A-F, indexed by register code
         
         self.running = True
         
         self.cycles = 0
         
-        # Initialize pygame screen for 256x256 resolution
-        self.V_res = -1
-        self.H_res = -1
-        self.screen = None
+        # Display backend for the graphics and key interrupts: "window" (pygame),
+        # "headless" (in memory only) or a display object, see display.py
+        self.display = DISPLAYS[display]() if isinstance(display, str) else display
+        self.keyboard = self.display.keyboard  # filled by the display's event pump, see keyboard.py
         
         self.keydown = False
         self.last_key = None
         
-        
-        self.text_buffer = None  # Space and white color
+        # Disk drives for the disk interrupts, drive{N}.bin in the current directory by default
+        self.drives = DriveSet() if drives is None else drives
 
+        self._dispatch = self._build_dispatch()
+        self._decoded = {}  # PC -> (handler, operands, length, opcode)
+        self._decoded_end = 0  # first address past all decoded code
+        self._fault_opcode = None  # opcode of the instruction that raised, for the error interrupt
+        
+        # Fused instruction sequences for the interpreter loop, see fusion.py
+        self.fuse = fuse
+        self._fused = {}  # PC -> decoded entry, fused or not
+        
+        # Basic-block compiler, see jit.py
+        self.jit = jit
+        self._blocks = {}  # PC -> (compiled block, end address)
+        
+        # Execution counters, None unless profiling, see profile()
+        self.profiler = None
+        # Recent instructions, None unless tracing, see trace()
+        self.tracer = None
+        if profile:
+            self.profile(True)
         
         
         
@@ -44,7 +119,7 @@ class CPU:
         
         # Print Stack (if needed, in a similar hex format)
         print("\nStack:")
-        print(self.stack)
+        print(self.stack.tolist())
         
         # Print Total Cycles
         print(f"\nTotal Cycles: {self.cycles}")
@@ -52,197 +127,322 @@ class CPU:
         # Print Memory in Hex, with addresses on the left and values aligned
         print("\nMemory:")
         i = 0
-        for address in range(0, len(self.memory), 16):  # Iterate by 16 values (one row at a time)
+        if self.paged:  # only the pages the program wrote to
+            addresses = [address for start, _ in self.memory.touched()
+                         for address in range(start, min(start + PAGE_SIZE, len(self.memory)), 16)]
+            print(f"({len(self.memory.touched())} pages in use, the rest is zero)")
+        else:
+            addresses = range(0, len(self.memory), 16)
+        for address in addresses:  # Iterate by 16 values (one row at a time)
             # Print address
             print(f"0x{address:04X}: ", end="")  # Print the memory address in hex (4 digits)
             
             # Print 16 values on the same line
+            row = self.memory_view[address:address + 16]  # no copy
             for j in range(16):
-                if address + j < len(self.memory):  # Avoid out-of-bounds
-                    print(f"{self.memory[address + j]:02X}", end=" ")
+                if j < len(row):  # Avoid out-of-bounds
+                    print(f"{row[j]:02X}", end=" ")
                 else:
                     print("   ", end=" ")  # Empty spaces for remaining uninitialized memory
             print()  # Move to the next line
+        
+        if self.profiler is not None:
+            print()
+            print(self.profiler.report())
+    
+    
+    def profile(self, enabled=True):
+        """Switch profiling on or off, returns the Profiler (counters survive switching off).
+        
+        While profiling the interpreter loop runs with counting added (also
+        when jit is set) and interrupts go through a timing wrapper.
+        """
+        profiler = self.profiler
+        if enabled and profiler is None:
+            profiler = self.profiler = Profiler(len(self.memory))
+            self._int = profiler.timed(CPU._int.__get__(self))
+        elif not enabled and profiler is not None:
+            self.profiler = None
+            del self._int  # back to the plain method
+        else:
+            return profiler
+        self._rebuild_caches()
+        return profiler
+    
+    def trace(self, enabled=True, size=TRACE_SIZE):
+        """Switch instruction tracing on or off, returns the Tracer.
+        
+        Takes effect from the next run slice. While tracing the interpreter
+        loop runs (also when jit is set) and records every instruction, the
+        error interrupt prints the newest entries.
+        """
+        if not enabled:
+            tracer, self.tracer = self.tracer, None
+            return tracer
+        if self.tracer is None or self.tracer.size != size:
+            self.tracer = Tracer(size)
+        return self.tracer
     
+    def _rebuild_caches(self):
+        """Drop everything that holds on to a handler, after handlers were swapped."""
+        self._dispatch = self._build_dispatch()
+        self._decoded.clear()
+        self._fused.clear()
+        self._blocks.clear()
+        self._decoded_end = 0
     
 
-    def load_program(self, program):
-        """Load the machine code program into memory."""
-        self.memory[:len(program)] = program
+    def _resize(self, memory_size, word_size, stack_size, paged=None):
+        """(Re)allocate zeroed memory and stack, a no-op if the sizes already match."""
+        if word_size not in WORD_TYPES:
+            raise ValueError(f"Unsupported word size: {word_size}")
+        typecode = WORD_TYPES[word_size]
+        if paged is None:
+            paged = memory_size > DENSE_LIMIT
+        if self.memory is not None and (self.memory.typecode, len(self.memory), len(self.stack), self.paged) == (
+                typecode, memory_size, stack_size, paged):
+            return
+        self.word_size = word_size
+        self.word_mask = word_mask(word_size)  # stores and pushes go through value & word_mask
+        self.paged = paged
+        if paged:
+            self.memory = PagedMemory(memory_size, typecode)
+            self.memory_view = self.memory  # slices are copies
+        else:
+            self.memory = array(typecode, bytes(memory_size * word_size))  # Fixed-size memory
+            self.memory_view = memoryview(self.memory)  # zero-copy slices of memory
+        self.stack = array(typecode, bytes(stack_size * word_size))
+        if getattr(self, "_dispatch", None) is not None:  # memory handlers depend on the memory type
+            self._rebuild_caches()
+        if getattr(self, "profiler", None) is not None:  # per address counters
+            self.profiler = None
+            self.profile(True)
+    
+    def save_snapshot(self, file):
+        """Save the whole machine to a file (path or binary file object), see snapshot.py."""
+        self.drives.sync()
+        if hasattr(file, "write"):
+            snapshot.save(self, file)
+            return
+        with open(file, "wb") as f:
+            snapshot.save(self, f)
+    
+    def load_snapshot(self, file):
+        """Restore the machine from a file written by save_snapshot()."""
+        if hasattr(file, "read"):
+            snapshot.load(self, file)
+        else:
+            with open(file, "rb") as f:
+                snapshot.load(self, f)
+        self._decoded.clear()
+        self._fused.clear()
+        self._blocks.clear()
+        self._decoded_end = 0
+    
+    def load_program(self, program, address=0):
+        """Load the machine code program into memory at address.
+        
+        program is a list of words or any buffer (bytes, array, mmap, ...)
+        holding words of the CPU's word size, buffers are copied in one block.
+        A path loads a program image (see image.py), mapped from the file,
+        at its own load addresses and sets the PC to its entry point.
+        """
+        if isinstance(program, (str, os.PathLike)):
+            image.load(self, program)
+            return
+        typecode = self.memory.typecode
+        if isinstance(program, (list, tuple)) or (isinstance(program, array) and program.itemsize != self.word_size):
+            program = array(typecode, [word & self.word_mask for word in program])
+        # arrays of the same word size are taken as they are, e.g. array("q") reads as two's complement
+        words = memoryview(program).cast("B").cast(typecode)
+        if address + len(words) > len(self.memory):
+            raise ValueError(f"Program too big for memory, size: {len(words)}")
+        self.memory_view[address:address + len(words)] = words
+        self._decoded.clear()
+        self._fused.clear()
+        self._blocks.clear()
+        self._decoded_end = 0
         
 
     def fetch(self):
-        """Fetch the next instruction."""
-        if self.PC >= len(self.memory):
+        """Fetch the next (pre-decoded) instruction."""
+        pc = self.PC
+        if pc >= len(self.memory):
             self.running = False
             return None
         
-        # Check for 4-byte instructions
-        opcode = self.memory[self.PC]
-        length = 4 if opcode in (0x08, 0x09) else 3
-        instruction = self.memory[self.PC:self.PC + length]
+        instruction = self._decoded.get(pc)
+        if instruction is None:
+            instruction = self._decode(pc)
         
-        if len(instruction) < length:
-            instruction += [0] * (length - len(instruction))
+        self.PC = pc + instruction[2]
+        return instruction
+
+    def _fetch_fused(self):
+        """fetch() returning fused instruction sequences as one entry."""
+        pc = self.PC
+        if pc >= len(self.memory):
+            self.running = False
+            return None
         
-        self.PC += length
+        instruction = self._fused.get(pc) or self._decode_fused(pc)
+        self.PC = pc + instruction[2]
         return instruction
 
 
 
     def execute(self, instruction):
-        self.cycles+=1
-        #print(self.PC)
         """Execute an instruction."""
+        self.cycles+=1
         if instruction is None:
             return
+        instruction[0](*instruction[1])
 
-        opcode = instruction[0]
-        if opcode == 0x00:  # Halt
-            self.running = False
-        elif opcode == 0x01:  # LOAD
-            reg, value = instruction[1], instruction[2]
-            self._load(reg, value)
-        elif opcode == 0x02:  # MOV
-            dest, src = instruction[1], instruction[2]
-            self._mov(dest, src)
-        elif opcode == 0x03:  # ADD
-            dest, src = instruction[1], instruction[2]
-            self._add(dest, src)
-        elif opcode == 0x04:  # SUB
-            dest, src = instruction[1], instruction[2]
-            
-            self._sub(dest, src)
-            
-        elif opcode == 0x05:  # STORE
-            reg, addr = instruction[1], instruction[2]
-            self._store(reg, addr)
-        elif opcode == 0x06:  # LOADM
-            reg, addr = instruction[1], instruction[2]
-            self._loadm(reg, addr)
-        elif opcode == 0x08:  # BNE (Branch if Not Equal)
-            reg, reg2, target = instruction[1], instruction[2], instruction[3]
-            self._bne(reg, reg2, target)
-        elif opcode == 0x09:  # beq (Branch if Equal)
-            reg, reg2, target = instruction[1], instruction[2], instruction[3]
-            self._beq(reg, reg2, target)
-        elif opcode == 0x0A:  # int interupt handler
-            value, opt = instruction[1], instruction[2]
-            self._int(value, opt)
-        elif opcode == 0x0B:  # push stack
-            reg, opt = instruction[1], instruction[2]
-            self._push(reg, opt)
-            
-        elif opcode == 0x0C:  # pop stack
-            reg, opt = instruction[1], instruction[2]
-            self._pop(reg, opt)
-        elif opcode == 0x0D:  # pop stack
-            value, opt = instruction[1], instruction[2]
-            self._jsr(value, opt)
-        elif opcode == 0x0E:  # pop stack
-            value, opt = instruction[1], instruction[2]
-            self._ret(value, opt)
-        
-        elif opcode == 0x0F:  # xor
-            reg, reg2 = instruction[1], instruction[2]
-            self._xor(reg, reg2)
+
+
+    def _build_dispatch(self):
+        """Build the opcode -> handler table, specialized by instruction format and memory type."""
+        dispatch = {opcode: (getattr(self, name), length == 4)
+                    for opcode, (name, length, _) in OPCODES.items()}
+        if self.paged:
+            dispatch[0x05] = (self._store_paged, False)
+            dispatch[0x06] = (self._loadm_paged, False)
+        return dispatch
+
+
+    def _decode(self, addr):
+        """Decode the instruction at addr into an immutable cache entry."""
+        memory = self.memory
+        opcode = memory[addr]
+        entry = self._dispatch.get(opcode)
+        if entry is None:
+            handler, operands, length = self._unknown_opcode, (opcode,), 3
+        else:
+            handler, wide = entry
+            length = 4 if wide else 3
+            operands = tuple(memory[addr + 1:addr + length])
+            if len(operands) < length - 1:  # instruction runs off the end of memory
+                operands += (0,) * (length - 1 - len(operands))
             
-        elif opcode == 0x10:  # and
-            reg, reg2 = instruction[1], instruction[2]
-            self._and(reg, reg2)
+            # resolve branch targets once instead of on every taken branch
+            if opcode in CHECKED_BRANCHES and not 0 <= operands[2] < len(memory):
+                handler = partial(self._bad_branch, CHECKED_BRANCHES[opcode])
             
-        elif opcode == 0x11:  # jmp
-            addr, opt = instruction[1], instruction[2]
-            self._jmp(addr, opt)
+            # check register operands once so handlers can index self.regs directly
+            for reg in operands[:OPCODES[opcode][2]]:
+                if not 0 <= reg < len(self.regs):
+                    handler = partial(self._bad_register, reg)
+                    break
         
-        elif opcode == 0x12:  # mul
-            reg1, reg2 = instruction[1], instruction[2]
-            self._mul(reg1, reg2)
-            
-        elif opcode == 0x13:  # div
-            reg1, reg2 = instruction[1], instruction[2]
-            self._div(reg1, reg2)
-            
-        elif opcode == 0x14:  # beq (Branch if Equal)
-            reg, reg2, target = instruction[1], instruction[2], instruction[3]
-            self._blt(reg, reg2, target)
+        instruction = (handler, operands, length, opcode)
+        self._decoded[addr] = instruction
+        if addr + length > self._decoded_end:
+            self._decoded_end = addr + length
+        return instruction
+
+
+    def _decode_fused(self, addr):
+        """The fused run loop entry for addr (see fusion.py), cached like _decode."""
+        instruction = self._decoded.get(addr) or self._decode(addr)
+        instruction = self._fused[addr] = fusion.fuse(self, addr, instruction)
+        return instruction
+
+
+    def _invalidate(self, addr, end=None):
+        """Drop decoded instructions and compiled blocks that overlap written addresses.
         
-        else:
-            raise ValueError(f"Unknown opcode: {opcode}")
+        Covers addr, or the range addr to end for block writes.
+        """
+        if end is None:
+            end = addr + 1
+        decoded = self._decoded
+        for start in range(max(0, addr - MAX_INSTRUCTION_LENGTH + 1), min(end, self._decoded_end)):
+            instruction = decoded.get(start)
+            if instruction is not None and start + instruction[2] > addr:
+                del decoded[start]
+        
+        fused = self._fused
+        if fused:
+            for start in range(max(0, addr - fusion.MAX_LENGTH + 1), min(end, self._decoded_end)):
+                instruction = fused.get(start)
+                if instruction is not None and start + instruction[2] > addr:
+                    del fused[start]
+        
+        if self._blocks:
+            for start, (block, block_end) in list(self._blocks.items()):
+                if start < end and addr < block_end:
+                    del self._blocks[start]
+
 
+    def _run_block(self):
+        """Run the compiled basic block at PC, compiling it on first use."""
+        pc = self.PC
+        if pc >= len(self.memory):  # same as fetch() running off the end
+            self.cycles += 1
+            self.running = False
+            return
+        
+        entry = self._blocks.get(pc)
+        if entry is None:
+            entry = self._blocks[pc] = jit.compile_block(self, pc, OPCODES)
+            if entry[1] > self._decoded_end:
+                self._decoded_end = entry[1]
+        entry[0](self)
+
+
+    def _unknown_opcode(self, opcode):
+        raise ValueError(f"Unknown opcode: {opcode}")
+
+    def _bad_register(self, reg, *operands):
+        raise ValueError(f"Invalid register: {reg}")
 
 
+    def _halt(self, value, opt):
+        self.running = False
+
+    # Register operands are checked by _decode, so the handlers below
+    # index self.regs directly.
+
     def _mul(self, reg1, reg2):
-        result = self._get_register(reg1) * self._get_register(reg2)
-        self._set_register(reg1, result)
+        self.regs[reg1] *= self.regs[reg2]
         
     def _div(self, reg1, reg2):
-        a = int(self._get_register(reg1))
-        b = int(self._get_register(reg2))
-        if b == 0:
+        regs = self.regs
+        if regs[reg2] == 0:
             raise ZeroDivisionError("Divided by 0")
-        result = a / b
-        self._set_register(reg1, result)
+        regs[reg1] //= regs[reg2]  # integer division, registers only hold ints
         
         
     def _xor(self, reg, reg2):
-        # Retrieve values from the registers, ensuring they're integers
-        val1 = int(self._get_register(reg))
-        val2 = int(self._get_register(reg2))
-        # Perform XOR operation
-        result = val1 ^ val2
-    
-        # Ensure the result is also an integer and set it back to the register
-        self._set_register(reg, result)
+        self.regs[reg] ^= self.regs[reg2]
         
     def _and(self, reg, reg2):
-        result = self._get_register(reg) & self._get_register(reg2)
-        self._set_register(reg, result)
+        self.regs[reg] &= self.regs[reg2]
         
     
     def _load(self, reg, value):
-        if reg == 0x00:
-            self.A = value
-        elif reg == 0x01:
-            self.B = value
-        elif reg == 0x02:
-            self.C = value
-        elif reg == 0x03:
-            self.D = value
-        elif reg == 0x04:
-            self.E = value
-        elif reg == 0x05:
-            self.F = value
-        else:
-            raise ValueError("Invalid register.")
+        self.regs[reg] = value
             
     def _push(self, reg, opt):
         self.SP -= 1
         if self.SP < 0:
-            #print(f"STACK OVERFLOW: SP={self.SP}")
             raise OverflowError("Stack overflow")
-        val = self._get_register(reg)
-        self.stack[self.SP] = val
-        #print(f"PUSH: SP={self.SP}, VALUE={val}, STACK={self.stack}")
+        self.stack[self.SP] = self.regs[reg] & self.word_mask
     
     def _pop(self, reg, opt):
         if self.SP >= len(self.stack):
-            #print(f"STACK UNDERFLOW: SP={self.SP}")
             raise OverflowError("Stack underflow")
         val = self.stack[self.SP]
         self.stack[self.SP] = 0
         self.SP += 1
-        self._set_register(reg, val)
-        #print(f"POP: SP={self.SP}, VALUE={val}, STACK={self.stack}")
+        self.regs[reg] = val
 
     def _jsr(self, value, opt):
         self.SP -= 1
         if self.SP < 0:
-            #print(f"STACK OVERFLOW: SP={self.SP}")
             raise OverflowError("Stack overflow")
-        self.stack[self.SP] = self.PC+3
+        self.stack[self.SP] = (self.PC + 3) & self.word_mask
         self.PC = value
-        #print(f"JSR: SP={self.SP}, PC={self.PC}, STACK={self.stack}")
         
     def _jmp(self, value, opt):
         self.PC = value
@@ -251,13 +451,11 @@ class CPU:
     
     def _ret(self, value, opt):
         if self.SP >= len(self.stack):
-            #print(f"STACK UNDERFLOW: SP={self.SP}")
             raise OverflowError("Stack underflow")
         address = self.stack[self.SP]
         self.stack[self.SP] = 0
         self.SP += 1
         self.PC = address
-        #print(f"RET: SP={self.SP}, PC={self.PC}, STACK={self.stack}")
     
         
         
@@ -266,32 +464,7 @@ class CPU:
         mode = self._get_register(0x0)
         x = self._get_register(0x1)
         y = self._get_register(0x2)
-    
-        self.V_res = y
-        self.H_res = x
-        self.mode = mode  # Save the display mode
-    
-        pygame.init()
-    
-        if mode == 0:  # Bitmap mode
-            self.screen = pygame.display.set_mode((x, y))
-            self.screen.fill((0, 0, 0))  # Black background
-            pygame.display.set_caption("Bitmap Mode")
-        elif mode == 1:  # Text mode
-            self.cell_width = 10  # Width of each text cell (in pixels)
-            self.cell_height = 16  # Height of each text cell (in pixels)
-            self.max_columns = self.H_res // self.cell_width
-            self.max_rows = self.V_res // self.cell_height
-    
-            # Initialize the text buffer
-            self.text_buffer = [[(0x20, 0xFFFFFF) for _ in range(self.max_columns)] for _ in range(self.max_rows)]
-            
-            self.font = pygame.font.Font(pygame.font.get_default_font(), self.cell_height)
-            self.screen = pygame.display.set_mode((x, y))
-            self.screen.fill((0, 0, 0))  # Black background
-            pygame.display.set_caption("Text Mode")
-        else:
-            raise ValueError("Invalid display mode")
+        self.display.init(mode, x, y)
     
     
     
@@ -307,6 +480,14 @@ class CPU:
             self._set_pixel()
         elif value == 0x72:  # Render character (text mode)
             self._add_text()
+        elif value == 0x73:  # Fill rectangle (bitmap mode)
+            self._fill_rect()
+        elif value == 0x74:  # Horizontal line (bitmap mode)
+            self._line(horizontal=True)
+        elif value == 0x75:  # Vertical line (bitmap mode)
+            self._line(horizontal=False)
+        elif value == 0x76:  # Copy a block of memory to the screen (bitmap mode)
+            self._blit_memory()
         
         #? Terminal Interrupts
         elif value == 0x00:  # Print character
@@ -319,34 +500,35 @@ class CPU:
             self.running = False
             return
         elif value == 0xF6:  # Get key down
-            keys = pygame.key.get_pressed()  # Get the state of all keys
+            current_key = self.keyboard.current  # Track the currently detected key
             
-            key_pressed = False  # Flag to check if a key was pressed in this cycle
-            current_key = None  # Track the currently detected key
-        
-            for keycode in range(len(keys)):
-                if keys[keycode]:  # If this key is pressed
-                    current_key = keycode  # Set the current key
-                    
-                    self._set_register(0x0, keycode)  # Set register A to the keycode
-        
-                    if not self.keydown or (self.last_key != current_key):  
-                        # If it's the first press or a new key is pressed
-                        self._set_register(0x1, 1)  # Set register B to indicate a new key press
-                        self.keydown = True  # Mark that a key is pressed
-                        self.last_key = current_key  # Update the last pressed key
-                    else:
-                        # If the same key is still being held
-                        self._set_register(0x1, 0)  # Set register B to indicate no new key
-                    key_pressed = True
-                    return
+            if current_key is not None:  # If a key is pressed
+                self._set_register(0x0, current_key)  # Set register A to the keycode
+        
+                if not self.keydown or (self.last_key != current_key):  
+                    # If it's the first press or a new key is pressed
+                    self._set_register(0x1, 1)  # Set register B to indicate a new key press
+                    self.keydown = True  # Mark that a key is pressed
+                    self.last_key = current_key  # Update the last pressed key
+                else:
+                    # If the same key is still being held
+                    self._set_register(0x1, 0)  # Set register B to indicate no new key
         
-            if not key_pressed:  # If no key is pressed (key release)
+            else:  # If no key is pressed (key release)
                 self._set_register(0x0, 0)  # Set register A to 0 (no key pressed)
                 self._set_register(0x1, 0)  # Set register B to 0 (reset key state)
                 self.keydown = False  # Reset the keydown flag
                 self.last_key = None  # Clear the last pressed key
         
+        elif value == 0xF7:  # Get the next key press from the key buffer
+            key = self.keyboard.next_key()
+            if key is not None:
+                self._set_register(0x0, key)  # Set register A to the keycode
+                self._set_register(0x1, 1)  # Set register B to indicate a key was read
+            else:
+                self._set_register(0x0, 0)
+                self._set_register(0x1, 0)  # Set register B to 0 (buffer empty)
+        
 
 
         
@@ -356,6 +538,9 @@ class CPU:
             print(f"Register A: {self._get_register(0)}")
             print(f"Register B: {self._get_register(1)}")
             print(f"Register C: {self._get_register(2)}")
+            if self.tracer is not None:
+                print("Last instructions:")
+                print(self.tracer.dump(TRACE_DUMP))
             self.running = False 
             
             
@@ -363,9 +548,18 @@ class CPU:
         elif value == 0x80:  # Read byte from disk
             self._read_byte_from_disk(opt)
             
-        elif value == 0x81:  # Read byte from disk
+        elif value == 0x81:  # Write byte to disk
             self._write_byte_from_disk(opt)
             
+        elif value == 0x82:  # Read sectors from disk into memory
+            self._read_sectors_from_disk()
+            
+        elif value == 0x83:  # Write memory to sectors on disk
+            self._write_sectors_to_disk()
+            
+        elif value == 0x84:  # Flush written bytes to the drive files
+            self.drives.sync()
+            
             
         
         else:
@@ -376,61 +570,11 @@ class CPU:
         # a = drive number (0-9)
         # b = sector number (0-15)
         # c = byte offset within sector (0-254)
-        
-        drive_number = self._get_register(0x0)  # Drive number
-        sector_number = self._get_register(0x1)  # Sector number
-        byte_offset = self._get_register(0x2)  # Byte offset within sector
-    
-        # Validate input values and trigger error interrupt if invalid
-        if not (0 <= drive_number <= 9):
-            self._set_register(0x0, 0x81)  # Error code 1: Invalid drive number
-            self._set_register(0x1, self.PC)  # Set current PC to register 0xB
-            self._set_register(0x2, 0)  # Set register 0xC to 0 as specified
-            self._int(0xFE, 0)  # Trigger the error interrupt
-            return
-    
-        if not (0 <= sector_number <= 15):
-            self._set_register(0x0, 0x82)  # Error code 2: Invalid sector number
-            self._set_register(0x1, self.PC)
-            self._set_register(0x2, 0)
-            self._int(0xFE, 0)
-            return
-    
-        if not (0 <= byte_offset <= 254):
-            self._set_register(0x0, 0x83)  # Error code 3: Invalid byte offset
-            self._set_register(0x1, self.PC)
-            self._set_register(0x2, 0)
-            self._int(0xFE, 0)
-            return
-        
-        # Construct the disk file path (e.g., "disk0.bin", "disk1.bin")
-        disk_file = f"disk{drive_number}.bin"
-        
-        if not os.path.exists(disk_file):
-            self._set_register(0x0, 0x84)  # Error code 4: Disk file not found
-            self._set_register(0x1, self.PC)
-            self._set_register(0x2, 0)
-            self._int(0xFE, 0)
-            return
-    
-        # Open the disk file and read the desired byte
-        with open(disk_file, 'rb') as f:
-            # Calculate the position to read from: 
-            # (sector_number * 255 bytes per sector) + byte_offset
-            position = (sector_number * 255) + byte_offset
-            f.seek(position)
-            
-            byte_value = f.read(1)  # Read one byte
-            if len(byte_value) == 0:
-                self._set_register(0x0, 0x85)  # Error code 5: Failed to read byte
-                self._set_register(0x1, self.PC)
-                self._set_register(0x2, 0)
-                self._int(0xFE, 0)
-                return
-    
-        # Store the byte value in a register (0x4 for this example)
-        self._set_register(0x4, byte_value[0])  # Store byte in register 0x4
-        #print(f"Read byte: {byte_value[0]:#04x} from {disk_file}, sector {sector_number}, byte {byte_offset}")
+        # the byte read goes into register E
+        try:
+            self.regs[4] = self.drives.read_byte(*self.regs[:3])
+        except DriveError as e:
+            self._disk_error(e.code)
         
     def _write_byte_from_disk(self, opt):
         # Register layout:
@@ -438,58 +582,67 @@ class CPU:
         # b = sector number (0-15)
         # c = byte offset within sector (0-254)
         # d = byte value to write (0-255)
-        
-        drive_number = self._get_register(0x0)  # Drive number
-        sector_number = self._get_register(0x1)  # Sector number
-        byte_offset = self._get_register(0x2)  # Byte offset within sector
-        byte_to_write = self._get_register(0x3)  # Byte to write
-        
+        try:
+            self.drives.write_byte(*self.regs[:4])
+        except DriveError as e:
+            self._disk_error(e.code)
     
-        # Validate input values and trigger error interrupt if invalid
-        if not (0 <= drive_number <= 9):
-        
-            self._set_register(0x0, 0x81)  # Error code 1: Invalid drive number
-            self._set_register(0x1, self.PC)  # Set current PC to register 0xB
-            self._set_register(0x2, 0)  # Set register 0xC to 0 as specified
-            self._int(0xFE, 0)  # Trigger the error interrupt
-            return
+    def _sector_transfer(self):
+        """Registers of a sector transfer, (drive, sector, memory address, memory end).
+
+        Disk errors are checked first and reported through the error
+        interrupt, then None is returned.
+        """
+        # a = drive number (0-9)
+        # b = first sector number (0-15)
+        # c = memory address, one byte per word
+        # d = number of sectors
+        drive_number, sector_number, addr, count = self.regs[:4]
+        try:
+            self.drives.check_transfer(drive_number, sector_number, count)
+        except DriveError as e:
+            self._disk_error(e.code)
+            return None
+        end = addr + count * SECTOR_SIZE
+        if addr < 0 or end > len(self.memory):
+            raise ValueError("Invalid memory address.")
+        return drive_number, sector_number, addr, end
     
-        if not (0 <= sector_number <= 15):
-            
-            self._set_register(0x0, 0x82)  # Error code 2: Invalid sector number
-            self._set_register(0x1, self.PC)
-            self._set_register(0x2, 0)
-            self._int(0xFE, 0)
+    def _read_sectors_from_disk(self):
+        transfer = self._sector_transfer()
+        if transfer is None:
             return
-    
-        if not (0 <= byte_offset <= 254):   
-            self._set_register(0x0, 0x83)  # Error code 3: Invalid byte offset
-            self._set_register(0x1, self.PC)
-            self._set_register(0x2, 0)
-            self._int(0xFE, 0)
+        drive_number, sector_number, addr, end = transfer
+        try:
+            data = self.drives.read_sectors(drive_number, sector_number, self.regs[3])
+        except DriveError as e:
+            self._disk_error(e.code)
             return
+        if self.word_size == 1:
+            self.memory_view[addr:end] = data  # one byte per word, copied as is
+        else:  # through a memoryview, array(typecode, bytes) would read the bytes as raw words
+            self.memory_view[addr:end] = array(self.memory.typecode, memoryview(data))
+        if addr < self._decoded_end:  # loaded over code
+            self._invalidate(addr, end)
     
-        # Construct the disk file path (e.g., "disk0.bin", "disk1.bin")
-        disk_file = f"drive{drive_number}.bin"
-        
-        if not os.path.exists(disk_file):
-            print(0x84)
-            self._set_register(0x0, 0x84)  # Error code 4: Disk file not found
-            self._set_register(0x1, self.PC)
-            self._set_register(0x2, 0)
-            self._int(0xFE, 0)
+    def _write_sectors_to_disk(self):
+        transfer = self._sector_transfer()
+        if transfer is None:
             return
-        
-        # Open the disk file in 'r+b' mode for reading and writing
-        with open(disk_file, 'r+b') as f:
-            # Calculate the position to write to: 
-            # (sector_number * 255 bytes per sector) + byte_offset
-            position = (sector_number * 255) + byte_offset
-            f.seek(position)  # Move the file pointer to the desired position
-            
-            # Write the byte to the file
-            f.write(bytes([byte_to_write]))  # Write a single byte to the file
-        #print(f"Written byte: {byte_to_write:#04x} to {disk_file}, sector {sector_number}, byte {byte_offset}")
+        drive_number, sector_number, addr, end = transfer
+        words = self.memory_view[addr:end]
+        data = bytes(words) if self.word_size == 1 else bytes(iter(words))  # ValueError if a word isn't a byte
+        try:
+            self.drives.write_sectors(drive_number, sector_number, data)
+        except DriveError as e:
+            self._disk_error(e.code)
+    
+    def _disk_error(self, code):
+        """Report a disk error (0x81 - 0x86, see drives.py) through the error interrupt."""
+        self._set_register(0x0, code)  # Error code
+        self._set_register(0x1, self.PC)  # Set current PC to register 0xB
+        self._set_register(0x2, 0)  # Set register 0xC to 0 as specified
+        self._int(0xFE, 0)  # Trigger the error interrupt
     
 
             
@@ -503,90 +656,80 @@ class CPU:
         print(char)
 
     def _mov(self, dest, src):
-        value = self._get_register(src)
-        self._set_register(dest, value)
+        self.regs[dest] = self.regs[src]
 
     def _add(self, dest, src):
-        result = self._get_register(dest) + self._get_register(src)
-        self._set_register(dest, result)
+        self.regs[dest] += self.regs[src]
 
     def _sub(self, dest, src):
-    
-        result = self._get_register(dest) - self._get_register(src)
-        
-        self._set_register(dest, result)
+        self.regs[dest] -= self.regs[src]
 
     def _store(self, reg, addr):
         if addr < 0 or addr >= len(self.memory):
             raise ValueError("Invalid memory address.")
-        self.memory[addr] = self._get_register(reg)
+        self.memory[addr] = self.regs[reg] & self.word_mask
+        if addr < self._decoded_end:  # self-modifying code
+            self._invalidate(addr)
         
         
 
     def _loadm(self, reg, addr):
         if addr < 0 or addr >= len(self.memory):
             raise ValueError("Invalid memory address.")
-        value = self.memory[addr]
-        self._set_register(reg, value)
+        self.regs[reg] = self.memory[addr]
+
+    def _store_paged(self, reg, addr):
+        memory = self.memory
+        if addr < 0 or addr >= memory.size:
+            raise ValueError("Invalid memory address.")
+        page = memory.pages[addr >> PAGE_BITS]
+        if page is memory.zero:
+            page = memory.page(addr >> PAGE_BITS)
+        page[addr & PAGE_MASK] = self.regs[reg] & self.word_mask
+        if addr < self._decoded_end:  # self-modifying code
+            self._invalidate(addr)
+
+    def _loadm_paged(self, reg, addr):
+        memory = self.memory
+        if addr < 0 or addr >= memory.size:
+            raise ValueError("Invalid memory address.")
+        self.regs[reg] = memory.pages[addr >> PAGE_BITS][addr & PAGE_MASK]
         
         
     def _set_pixel(self):
-        if not self.screen or self.mode != 0:  # Ensure it's bitmap mode
-            return  
-
         _color = self._get_register(0)
         _x = self._get_register(1)
         _y = self._get_register(2)  
-
-        if 0 <= _x < self.H_res and 0 <= _y < self.V_res:
-            r = (_color & 0xFF0000) >> 16
-            g = (_color & 0x00FF00) >> 8
-            b = (_color & 0x0000FF)
-            self.screen.set_at((_x, _y), (r, g, b))
+        self.display.set_pixel(_color, _x, _y)
+    
+    
+    
+    def _fill_rect(self):
+        color, x, y, width, height = self.regs[:5]  # A B C D E
+        self.display.fill_rect(color, x, y, width, height)
+    
+    def _line(self, horizontal):
+        color, x, y, length = self.regs[:4]  # A B C D
+        if horizontal:
+            self.display.fill_rect(color, x, y, length, 1)
         else:
-            raise ValueError("Pixel coordinates out of bounds") 
+            self.display.fill_rect(color, x, y, 1, length)
     
+    def _blit_memory(self):
+        addr, x, y, width, height = self.regs[:5]  # A B C D E
+        size = width * height
+        if addr < 0 or size < 0 or addr + size > len(self.memory):
+            raise ValueError("Invalid memory address.")
+        self.display.blit(self.memory_view[addr:addr + size], x, y, width, height)
     
     
-    def _add_text(self):
-        if not self.screen or self.mode != 1:  # Ensure it's text mode
-            return
     
+    def _add_text(self):
         # Retrieve registers
         _char = self._get_register(0) & 0xFF  # ASCII character
         _cursor_pos = self._get_register(1)  # Current cursor position (in terms of character cells)
         _color = self._get_register(2)  # Text color
-    
-        # Ensure cursor position is within bounds
-        if _cursor_pos >= self.max_columns * self.max_rows:
-            _cursor_pos = (self.max_columns * self.max_rows) - 1
-    
-        # Calculate row and column from the cursor position
-        cursor_x = _cursor_pos % self.max_columns
-        cursor_y = _cursor_pos // self.max_columns
-    
-        # Update the text buffer
-        self.text_buffer[cursor_y][cursor_x] = (_char, _color)
-    
-        # Redraw the entire screen
-        self.screen.fill((0, 0, 0))  # Clear the screen
-        for row_index, row in enumerate(self.text_buffer):
-            for col_index, (char, color) in enumerate(row):
-                # Convert to pixel coordinates
-                _x = col_index * self.cell_width
-                _y = row_index * self.cell_height
-    
-                # Extract color components (RGB)
-                r = (color & 0xFF0000) >> 16
-                g = (color & 0x00FF00) >> 8
-                b = (color & 0x0000FF)
-    
-                # Render the character
-                text_surface = self.font.render(chr(char), True, (r, g, b))
-                self.screen.blit(text_surface, (_x, _y))
-    
-        # Update the display
-        pygame.display.flip()
+        self.display.set_char(_char, _cursor_pos, _color)
     
     
     
@@ -597,95 +740,205 @@ class CPU:
             
     def _bne(self, reg, reg2, target):
         """Branch to target address if register != value."""
-        if self._get_register(reg) != self._get_register(reg2):
-            if 0 <= target < len(self.memory):
-                self.PC = target
-            else:
-                raise ValueError(f"Invalid branch target address: {target}")
+        if self.regs[reg] != self.regs[reg2]:
+            self.PC = target
                 
     def _blt(self, reg, reg2, target):
         """Branch to target address if register < value."""
-        if self._get_register(reg) < self._get_register(reg2):
-            if 0 <= target < len(self.memory):
-                self.PC = target
-            else:
-                raise ValueError(f"Invalid branch target address: {target}")
+        if self.regs[reg] < self.regs[reg2]:
+            self.PC = target
+
+    def _bad_branch(self, compare, reg, reg2, target):
+        """Branch whose target failed validation at decode time, faults if taken."""
+        if compare(self.regs[reg], self.regs[reg2]):
+            raise ValueError(f"Invalid branch target address: {target}")
 
 
 
     def _beq(self, reg, reg2, target):
         """Branch to target address if register == value."""
-        if self._get_register(reg) == self._get_register(reg2):
+        if self.regs[reg] == self.regs[reg2]:
             self.PC = target
 
     def _get_register(self, reg):
-        if reg == 0x00:  # A
-            return self.A
-        elif reg == 0x01:  # B
-            return self.B
-        elif reg == 0x02:  # C
-            return self.C
-        elif reg == 0x03:
-            return self.D
-        elif reg == 0x04:
-            return self.E
-        elif reg == 0x05:
-            return self.F
-        else:
+        if not 0 <= reg < len(self.regs):
             raise ValueError(f"Invalid register: {reg}")
+        return self.regs[reg]
 
 
     def _set_register(self, reg, value):
-        if type(value) != int:
-            raise TypeError(f"Invalid register type")
-        if reg == 0x00:
-            self.A = value
-        elif reg == 0x01:
-            self.B = value
-        elif reg == 0x02:
-            self.C = value
-        elif reg == 0x03:
-            self.D = value
-        elif reg == 0x04:
-            self.E = value
-        elif reg == 0x05:
-            self.F = value
-        else:
+        if not 0 <= reg < len(self.regs):
             raise ValueError("Invalid register code.")
+        self.regs[reg] = value
+
+    def _slice_budget(self, mode, rate):
+        """Instructions per frame for a run mode, None when uncapped."""
+        if mode == "uncapped":
+            return None
+        if rate is None or rate <= 0:
+            raise ValueError(f"Run mode '{mode}' needs a positive rate")
+        if mode == "frame":  # N instructions per frame
+            return rate
+        if mode == "hz":  # N Hz guest clock
+            return rate / FRAME_RATE
+        raise ValueError(f"Unknown run mode: {mode}")
+
+    def _clip_budget(self, budget, max_cycles):
+        """Slice budget cut down to what is left of max_cycles."""
+        if max_cycles is None:
+            return budget
+        return min(budget, max_cycles - self.cycles)
+
+    def _run_slice(self, budget):
+        """Run up to budget instructions."""
+        if self.profiler is not None or self.tracer is not None:
+            self._run_slice_instrumented(budget)
+            return
+        if self.jit:
+            # a block can't stop half way, so the tail of the slice is interpreted
+            target = self.cycles + budget
+            last_block = target - jit.MAX_BLOCK_INSTRUCTIONS
+            while self.running and self.cycles <= last_block:
+                self._run_block()
+            budget = target - self.cycles
+            if not self.running or budget <= 0:
+                return
+        
+        if self.fuse:
+            # a fused entry runs up to fusion.MAX_INSTRUCTIONS instructions, so run in
+            # rounds that can't overshoot the budget and leave the tail unfused
+            target = self.cycles + budget
+            rounds = budget // fusion.MAX_INSTRUCTIONS
+            while rounds:
+                if not self._interpret(rounds, self._fused, self._decode_fused):
+                    return
+                rounds = (target - self.cycles) // fusion.MAX_INSTRUCTIONS
+            budget = target - self.cycles
+        self._interpret(budget, self._decoded, self._decode)
+
+    def _interpret(self, count, cache, decode):
+        """Run count entries of cache (decoded or fused instructions), returns running.
+        
+        fetch() and execute() inlined: one cache lookup, the PC and cycle
+        updates and the handler call with its pre-decoded operands.
+        """
+        memory_size = len(self.memory)
+        get = cache.get
+        instruction = None
+        try:
+            for _ in range(count):
+                pc = self.PC
+                if pc >= memory_size:
+                    self.cycles += 1
+                    self.running = False
+                    return False
+                instruction = get(pc) or decode(pc)
+                self.PC = pc + instruction[2]
+                self.cycles += 1
+                instruction[0](*instruction[1])
+                if not self.running:
+                    return False
+        except Exception:
+            self._fault_opcode = instruction[3]
+            raise
+        return True
+
+    def _run_slice_instrumented(self, budget):
+        """_run_slice feeding the profiler and/or the tracer."""
+        fetch = self.fetch
+        execute = self.execute
+        profiler = self.profiler
+        tracer = self.tracer
+        regs = self.regs
+        instruction = None
+        try:
+            for _ in range(budget):
+                pc = self.PC
+                instruction = fetch()
+                if instruction is None:
+                    execute(instruction)
+                    break
+                if profiler is not None:
+                    profiler.pcs[pc] += 1
+                    opcode = instruction[3]
+                    if 0 <= opcode < len(profiler.opcodes):
+                        profiler.opcodes[opcode] += 1
+                        if profiler.previous >= 0:
+                            profiler.pairs[profiler.previous * len(profiler.opcodes) + opcode] += 1
+                        profiler.previous = opcode
+                if tracer is not None:
+                    slot = tracer.record(pc, instruction[3], instruction[1])
+                    before = regs[:]
+                    execute(instruction)
+                    if regs != before:
+                        tracer.changed(slot, regs, before)
+                else:
+                    execute(instruction)
+                if not self.running:
+                    break
+        except Exception:
+            self._fault_opcode = instruction[3]
+            raise
+
+    def _pump_events(self):
+        if not self.display.pump():  # window closed
+            self.running = False
+        self.drives.poll()
+
+    def _present(self):
+        self.display.present()
 
-    def run(self):
-        """Run the loaded program with error interrupts."""
-        line = 0
-        timer = 0
+    def run(self, mode="uncapped", rate=None, max_cycles=None):
+        """Run the loaded program with error interrupts.
+        
+        Instructions run in slices, the host (display events and updates) is
+        only serviced between slices. mode selects the speed target:
+          "uncapped"  as fast as possible
+          "frame"     rate instructions per frame (FRAME_RATE frames a second)
+          "hz"        a guest clock of rate instructions per second
+        
+        With max_cycles the run returns once the cycle count reaches it,
+        running stays True and run() can be called again to continue.
+        """
+        per_frame = self._slice_budget(mode, rate)
+        frame_time = 1 / FRAME_RATE
+        next_frame = time.perf_counter() + frame_time
+        owed = 0  # instructions carried over between frames in "hz" mode
         try:
-            end = time.time()
-            start = time.time()
             while self.running:
-                start = time.time()
-    
-                instruction = self.fetch()
-                #print(instruction)
-    
-                if self.screen:
-                    if timer >= 1 / 60:
-                        pygame.display.update() 
-                        timer = 0
-    
-                    for event in pygame.event.get():
-                        if event.type == pygame.QUIT:
-                            self.running = False
-    
-                self.execute(instruction)
-                line += 1
-                end = time.time()
-                timer += end - start
+                if max_cycles is not None and self.cycles >= max_cycles:
+                    break
+                
+                if per_frame is None:
+                    self._run_slice(self._clip_budget(SLICE_INSTRUCTIONS, max_cycles))
+                    self._pump_events()
+                    now = time.perf_counter()
+                    if now >= next_frame:
+                        self._present()
+                        next_frame = now + frame_time
+                    continue
+                
+                owed += per_frame
+                budget = int(owed)
+                owed -= budget
+                self._run_slice(self._clip_budget(budget, max_cycles))
+                self._pump_events()
+                self._present()
+                
+                # wait for the end of the frame, don't try to catch up if we fell behind
+                now = time.perf_counter()
+                if now < next_frame:
+                    time.sleep(next_frame - now)
+                    next_frame += frame_time
+                else:
+                    next_frame = now + frame_time
     
         except ValueError as e:
             print(e, self.B, self.C)
             # Trigger an error interrupt with details
             self._set_register(0x0, 0x1) # Error Type
             self._set_register(0x1, self.PC) # Error Address
-            self._set_register(0x2, instruction[0]) # Error Type
+            self._set_register(0x2, self._fault_opcode) # Error Type
             
             self._int(0xFE, 0)
         except IndexError as e:
@@ -693,7 +946,7 @@ class CPU:
             # Trigger an error interrupt with details
             self._set_register(0x0, 0x2) # Error Type
             self._set_register(0x1, self.PC) # Error Address
-            self._set_register(0x2, instruction[0]) # Error Type
+            self._set_register(0x2, self._fault_opcode) # Error Type
             
             self._int(0xFE, 0)
         except OverflowError as e:
@@ -701,7 +954,7 @@ class CPU:
             # Trigger an error interrupt with details
             self._set_register(0x0, 0x3) # Error Type
             self._set_register(0x1, self.PC) # Error Address
-            self._set_register(0x2, instruction[0]) # Error Type
+            self._set_register(0x2, self._fault_opcode) # Error Type
             
             self._int(0xFE, 0)
             
@@ -710,9 +963,15 @@ class CPU:
             # Trigger an error interrupt with details
             self._set_register(0x0, 0x4) # Error Type
             self._set_register(0x1, self.PC) # Error Address
-            self._set_register(0x2, instruction[0]) # Error Type
+            self._set_register(0x2, self._fault_opcode) # Error Type
             
             self._int(0xFE, 0) # call error interrupt
+        
+        finally:
+            if self.running:  # stopped by max_cycles, the program can be resumed
+                self.drives.sync()
+            else:
+                self.drives.close()  # flush what the program wrote
             
         #ValueError, IndexError, OverflowError
         
@@ -726,10 +985,70 @@ program = [1, 0, 1, 1, 1, 800, 1, 2, 600, 10, 112, 0, 1, 1, 0, 1, 2, 16777215, 2
 
 
 
-# Initialize CPU, load program, and run
-cpu = CPU()
-cpu.load_program(program)
-cpu.run()
+def read_program(path, memory_size=256):
+    """Read a program: assembly source (.asm, assembled through the cache),
+    a program image (.img, returned as the path for CPU.load_program to map)
+    or a file with the list of words printed by asm-to-prg.py."""
+    if path.endswith(image.EXTENSION):
+        return path
+    if path.endswith(".asm"):
+        return assembler.assemble_file(path, memory_limit=memory_size)
+    with open(path) as f:
+        lines = [line for line in f.read().splitlines() if line.strip()]
+    if not lines:
+        raise ValueError(f"{path}: empty program file")
+    return ast.literal_eval(lines[-1])  # the list is the last line of the assembler output
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a program on the emulator.")
+    parser.add_argument("program", nargs="?",
+                        help=".asm source, .img image or file with the word list printed by asm-to-prg.py "
+                             "(default: built-in demo)")
+    parser.add_argument("--memory-size", type=int, default=256,
+                        help="memory size in words, up to 2**24 (paged above 2**16)")
+    parser.add_argument("--jit", action="store_true", help="compile basic blocks to Python")
+    parser.add_argument("--no-fuse", action="store_true", help="don't fuse common instruction sequences")
+    parser.add_argument("--headless", action="store_true", help="run without a window")
+    parser.add_argument("--mode", choices=("uncapped", "frame", "hz"), default="uncapped", help="speed target")
+    parser.add_argument("--rate", type=float, help="instructions per frame (frame) or per second (hz)")
+    parser.add_argument("--max-cycles", type=int, help="stop after this many instructions")
+    parser.add_argument("--profile", action="store_true", help="print an execution profile")
+    parser.add_argument("--profile-json", metavar="FILE", help="write the execution profile as JSON")
+    parser.add_argument("--trace", action="store_true", help="print the last instructions on errors")
+    parser.add_argument("--resume", metavar="SNAPSHOT", help="start from a snapshot instead of a program")
+    parser.add_argument("--save-snapshot", metavar="SNAPSHOT", help="save a snapshot when the run stops")
+    parser.add_argument("--quiet", action="store_true", help="don't print the machine state at the end")
+    args = parser.parse_args(argv)
+
+    try:
+        code = read_program(args.program, args.memory_size) if args.program else program
+    except assembler.AssemblyError as error:
+        print(error)
+        return 1
+
+    cpu = CPU(memory_size=args.memory_size, jit=args.jit, display="headless" if args.headless else "window",
+              profile=args.profile or args.profile_json is not None, fuse=not args.no_fuse)
+    if args.trace:
+        cpu.trace(True)
+    if args.resume:
+        cpu.load_snapshot(args.resume)
+    else:
+        cpu.load_program(code)
+    
+    cpu.run(args.mode, args.rate, args.max_cycles)
+    
+    if args.save_snapshot:
+        cpu.save_snapshot(args.save_snapshot)
+    if args.profile_json:
+        with open(args.profile_json, "w") as f:
+            f.write(cpu.profiler.json(indent=2))
+    if not args.quiet:
+        cpu.state()  # includes the profile
+    elif args.profile:
+        print(cpu.profiler.report())
+    return 0
 
 
-cpu.state()
\ No newline at end of file
+if __name__ == "__main__":
+    raise SystemExit(main())
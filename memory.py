@@ -0,0 +1,127 @@
+"""Sparse paged guest memory for large address spaces.
+
+PagedMemory stands in for the CPU's memory array when the memory is too
+big to allocate up front (more than DENSE_LIMIT words, up to a 24-bit
+address space). The address space is split into pages of PAGE_SIZE
+words, the page table is a flat list with one entry per page:
+
+    pages[addr >> PAGE_BITS][addr & PAGE_MASK]
+
+Untouched pages all share one read-only zero page, a page gets its own
+array on the first write to it, so host memory follows what the guest
+actually uses. Indexing and slicing work like the array it replaces,
+slices return copies.
+"""
+
+from array import array
+
+
+PAGE_BITS = 12
+PAGE_SIZE = 1 << PAGE_BITS  # words
+PAGE_MASK = PAGE_SIZE - 1
+
+DENSE_LIMIT = 1 << 16  # larger memories are paged by default
+MAX_SIZE = 1 << 24  # 24-bit addresses
+
+# word size in bytes -> array typecode used for memory and the stack. Narrow words
+# are unsigned and stores keep their low word_size bytes (see word_mask), 8 byte
+# words are signed so negative values read back as they were stored
+WORD_TYPES = {1: "B", 2: "H", 4: "I", 8: "q"}
+
+
+def word_mask(word_size):
+    """Mask stores apply to values: narrow words wrap to two's complement, -1 leaves
+    8 byte words as they are (values past 64 bits raise OverflowError)."""
+    return (1 << 8 * word_size) - 1 if word_size < 8 else -1
+
+
+class PagedMemory:
+    def __init__(self, size, typecode="q"):
+        if not 0 <= size <= MAX_SIZE:
+            raise ValueError(f"Unsupported memory size: {size}")
+        self.size = size
+        self.typecode = typecode
+        self.itemsize = array(typecode).itemsize
+        self.zero = array(typecode, bytes(PAGE_SIZE * self.itemsize))  # shared by untouched pages, never written
+        self.pages = [self.zero] * ((size + PAGE_MASK) >> PAGE_BITS)
+
+    def __len__(self):
+        return self.size
+
+    def page(self, number):
+        """Page number for writing, allocated on first use."""
+        page = self.pages[number]
+        if page is self.zero:
+            page = self.pages[number] = array(self.typecode, bytes(PAGE_SIZE * self.itemsize))
+        return page
+
+    def _range(self, index):
+        start, stop, step = index.indices(self.size)
+        if step != 1:
+            raise ValueError("Paged memory slices can't have a step")
+        return start, max(start, stop)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop = self._range(index)
+            words = array(self.typecode)
+            while start < stop:
+                offset = start & PAGE_MASK
+                end = min(stop, start - offset + PAGE_SIZE)
+                words += self.pages[start >> PAGE_BITS][offset:offset + end - start]
+                start = end
+            return words
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("memory index out of range")
+        return self.pages[index >> PAGE_BITS][index & PAGE_MASK]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            start, stop = self._range(index)
+            if len(value) != stop - start:
+                raise ValueError("Paged memory can't change size")
+            if isinstance(value, memoryview) and value.format == self.typecode:
+                value = array(self.typecode, value.tobytes())  # one copy, not word by word
+            elif not isinstance(value, array) or value.typecode != self.typecode:
+                value = array(self.typecode, value)
+            position = 0
+            while start < stop:
+                offset = start & PAGE_MASK
+                end = min(stop, start - offset + PAGE_SIZE)
+                words = value[position:position + end - start]
+                if any(words) or self.pages[start >> PAGE_BITS] is not self.zero:  # zeros leave pages untouched
+                    self.page(start >> PAGE_BITS)[offset:offset + end - start] = words
+                position += end - start
+                start = end
+            return
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("memory index out of range")
+        self.page(index >> PAGE_BITS)[index & PAGE_MASK] = value
+
+    def touched(self):
+        """(first address, page) of every allocated page, in address order."""
+        zero = self.zero
+        return [(number << PAGE_BITS, page) for number, page in enumerate(self.pages) if page is not zero]
+
+    def chunks(self):
+        """The whole memory as a sequence of page buffers (the last one cut to size)."""
+        for number, page in enumerate(self.pages):
+            start = number << PAGE_BITS
+            if start + PAGE_SIZE > self.size:
+                yield memoryview(page)[:self.size - start]
+            else:
+                yield page
+
+    def tolist(self):
+        return self[:].tolist()
+
+
+def chunks(memory):
+    """Buffers covering memory (an array or a PagedMemory) in order, e.g. for hashing."""
+    if isinstance(memory, PagedMemory):
+        return memory.chunks()
+    return (memory,)
@@ -0,0 +1,218 @@
+"""Peephole optimizer for assembled programs.
+
+optimize() rewrites the instructions (the IR) of an Assembly without
+errors and encodes them again, labels move with the code:
+
+    jump threading    jmp, jsr and branches to a jmp go straight to its
+                      target, a jmp to the next instruction is removed
+    no-ops            mov r, r
+    push / pop pairs  push r directly followed by pop r
+    dead writes       ldw, ldr, mov and arithmetic (not div, it can
+                      fault) whose register is written again or the
+                      program ends before anything reads it
+
+Register liveness is computed over the whole program. jsr and ret count
+as reading every register, interrupts read and write the registers in
+INTERRUPT_REGISTERS, and halt and the error interrupt end the program
+(the registers left behind are not program output). The instruction
+after a jsr is never touched, the return skips it and has to land where
+it used to. Removed pushes and pops no longer fault on a full or empty
+stack, everything else behaves the same in fewer cycles.
+"""
+
+from bisect import bisect_right
+
+from assembler import Assembly, encode
+
+
+A, B, C, D, E = 1, 2, 4, 8, 16  # register bits
+ALL = 0x3F
+
+# interrupt -> (registers read, registers always written), unknown ones read everything
+INTERRUPT_REGISTERS = {
+    0x00: (A, 0), 0x01: (A, 0),
+    0x70: (A | B | C, 0), 0x71: (A | B | C, 0), 0x72: (A | B | C, 0),
+    0x73: (A | B | C | D | E, 0), 0x74: (A | B | C | D, 0), 0x75: (A | B | C | D, 0),
+    0x76: (A | B | C | D | E, 0),
+    0xF6: (0, A | B), 0xF7: (0, A | B),
+    0x80: (A | B | C, E), 0x81: (A | B | C | D, 0),  # disk errors end the program
+    0x82: (A | B | C | D, 0), 0x83: (A | B | C | D, 0), 0x84: (0, 0),
+    0xFE: (A | B | C, 0), 0xFF: (0, 0),
+}
+ENDING_INTERRUPTS = {0xFE, 0xFF}
+
+BRANCHES = {"bne", "beq", "blt"}
+JUMPS = BRANCHES | {"jmp", "jsr"}
+ARITHMETIC = {"add", "sub", "xor", "and", "mul", "div"}
+PURE = {"ldw", "ldr", "mov", "add", "sub", "xor", "and", "mul"}  # only write their first register
+
+
+def registers(instruction):
+    """(registers read, registers written) by an instruction, as bit masks."""
+    mnemonic, operands = instruction.mnemonic, instruction.operands
+    if mnemonic in ("ldw", "ldr", "pop"):
+        return 0, 1 << operands[0]
+    if mnemonic == "mov":
+        return 1 << operands[1], 1 << operands[0]
+    if mnemonic in ARITHMETIC:
+        return 1 << operands[0] | 1 << operands[1], 1 << operands[0]
+    if mnemonic in ("str", "push"):
+        return 1 << operands[0], 0
+    if mnemonic in BRANCHES:
+        return 1 << operands[0] | 1 << operands[1], 0
+    if mnemonic == "int":
+        return INTERRUPT_REGISTERS.get(operands[0], (ALL, 0))
+    if mnemonic in ("jsr", "ret"):
+        return ALL, 0
+    return 0, 0  # jmp
+
+
+class _Program:
+    """The instructions being optimized, removed ones stay in place marked as removed."""
+
+    def __init__(self, assembly):
+        self.code = list(assembly.instructions)
+        self.count = len(self.code)
+        index = {instruction.address: position for position, instruction in enumerate(self.code)}
+        index[len(assembly.words)] = self.count  # labels at the end
+        self.targets = {label: index[address] for label, address in assembly.labels.items()}
+        self.removed = [False] * self.count
+        self.protected = {position + 1 for position, instruction in enumerate(self.code)
+                          if instruction.mnemonic == "jsr"}
+
+    def next(self, position):
+        """The first kept instruction at or after position (count for the end)."""
+        removed = self.removed
+        while position < self.count and removed[position]:
+            position += 1
+        return position
+
+    def target(self, label):
+        return self.next(self.targets[label])
+
+    def remove(self, position):
+        self.removed[position] = True
+
+    def successors(self, position):
+        instruction = self.code[position]
+        mnemonic = instruction.mnemonic
+        if mnemonic == "jmp":
+            return (self.target(instruction.operands[0]),)
+        if mnemonic in BRANCHES:
+            return self.target(instruction.operands[2]), self.next(position + 1)
+        if mnemonic in ("jsr", "ret"):
+            return ()  # reads every register, where it goes doesn't matter
+        if mnemonic == "int" and instruction.operands[0] in ENDING_INTERRUPTS:
+            return ()
+        return (self.next(position + 1),)
+
+    def thread_jumps(self):
+        changed = False
+        for position, instruction in enumerate(self.code):
+            if self.removed[position] or instruction.mnemonic not in JUMPS:
+                continue
+            label = instruction.operands[-1]
+            seen = {label}
+            target = self.target(label)
+            while target < self.count and self.code[target].mnemonic == "jmp":
+                label = self.code[target].operands[0]
+                if label in seen:  # jump loop
+                    break
+                seen.add(label)
+                target = self.target(label)
+            if label != instruction.operands[-1]:
+                self.code[position] = instruction._replace(operands=instruction.operands[:-1] + (label,))
+                changed = True
+        return changed
+
+    def remove_noops(self):
+        changed = False
+        labelled = set(self.targets.values())
+        for position, instruction in enumerate(self.code):
+            if self.removed[position] or position in self.protected:
+                continue
+            mnemonic, operands = instruction.mnemonic, instruction.operands
+            if mnemonic == "mov" and operands[0] == operands[1]:
+                self.remove(position)
+                changed = True
+            elif mnemonic == "jmp" and self.target(operands[0]) == self.next(position + 1):
+                self.remove(position)
+                changed = True
+            elif mnemonic == "push":
+                following = self.next(position + 1)
+                if (following < self.count and following not in self.protected
+                        and self.code[following].mnemonic == "pop" and self.code[following].operands == operands
+                        and labelled.isdisjoint(range(position + 1, following + 1))):  # nothing jumps between
+                    self.remove(position)
+                    self.remove(following)
+                    changed = True
+        return changed
+
+    def remove_dead_writes(self):
+        live_in = [0] * (self.count + 1)  # nothing is live at the end
+        live_out = [0] * self.count
+        masks = [registers(instruction) for instruction in self.code]
+        changed = True
+        while changed:
+            changed = False
+            for position in range(self.count - 1, -1, -1):
+                if self.removed[position]:
+                    continue
+                out = 0
+                for successor in self.successors(position):
+                    out |= live_in[successor]
+                read, written = masks[position]
+                live = read | (out & ~written)
+                live_out[position] = out
+                if live != live_in[position]:
+                    live_in[position] = live
+                    changed = True
+
+        removed = False
+        for position, instruction in enumerate(self.code):
+            if (not self.removed[position] and position not in self.protected and instruction.mnemonic in PURE
+                    and not masks[position][1] & live_out[position]):
+                self.remove(position)
+                removed = True
+        return removed
+
+
+def optimize(assembly):
+    """Optimize an Assembly without errors, returns (new Assembly, savings).
+
+    savings maps labels (None for code before the first one) to
+    (instructions removed, words saved) in the code following them.
+    """
+    program = _Program(assembly)
+    code = program.code
+    for position in program.protected:
+        if position < program.count and code[position].size != 3:
+            return assembly, {}  # the return from the jsr lands inside this instruction, leave it be
+
+    while program.thread_jumps() | program.remove_noops() | program.remove_dead_writes():  # all three every round
+        pass
+
+    kept = []
+    addresses = []  # new address per position, removed ones get the next kept one's
+    address = 0
+    for position, instruction in enumerate(code):
+        addresses.append(address)
+        if not program.removed[position]:
+            kept.append(instruction._replace(address=address))
+            address += instruction.size
+    addresses.append(address)
+    labels = {label: addresses[position] for label, position in program.targets.items()}
+
+    first = {}  # position -> the first label on it in the source
+    for label, position in program.targets.items():
+        first.setdefault(position, label)
+    starts = sorted(first)
+    savings = {}
+    for position, instruction in enumerate(code):
+        if program.removed[position]:
+            block = bisect_right(starts, position)
+            label = first[starts[block - 1]] if block else None
+            instructions, words = savings.get(label, (0, 0))
+            savings[label] = (instructions + 1, words + instruction.size)
+
+    return Assembly(encode(kept, labels), labels, kept, [], assembly.warnings), savings
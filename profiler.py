@@ -0,0 +1,111 @@
+"""Execution profiler for the CPU.
+
+Counts executed instructions per opcode, per pair of consecutive opcodes
+and per address, and interrupts per number along with the host time
+spent handling them. Counters are flat arrays indexed by opcode (first
+opcode * SLOTS + second for pairs), address and interrupt number.
+
+The CPU only touches the profiler when profiling is switched on (see
+CPU.profile), it then runs the interpreter loop with counting added and
+wraps its interrupt handler for timing.
+"""
+
+import json, time
+from array import array
+from collections import defaultdict
+
+
+REGISTER_NAMES = "ABCDEF"  # indexed by register code
+
+# opcode -> assembler mnemonic, for reports
+OPCODE_NAMES = {
+    0x00: "halt", 0x01: "ldw", 0x02: "mov", 0x03: "add", 0x04: "sub",
+    0x05: "str", 0x06: "ldr", 0x08: "bne", 0x09: "beq", 0x0A: "int",
+    0x0B: "push", 0x0C: "pop", 0x0D: "jsr", 0x0E: "ret", 0x0F: "xor",
+    0x10: "and", 0x11: "jmp", 0x12: "mul", 0x13: "div", 0x14: "blt",
+}
+
+SLOTS = 256  # opcodes and interrupt numbers counted (0 - 255)
+DENSE_PCS = 1 << 16  # larger memories count executions per address in a dict
+
+
+class Profiler:
+    def __init__(self, memory_size):
+        self.opcodes = array("Q", bytes(8 * SLOTS))  # executions per opcode
+        self.pairs = array("Q", bytes(8 * SLOTS * SLOTS))  # executions per (previous opcode, opcode)
+        self.previous = -1  # opcode executed last, -1 for none
+        if memory_size <= DENSE_PCS:
+            self.pcs = array("Q", bytes(8 * memory_size))  # executions per address
+        else:
+            self.pcs = defaultdict(int)
+        self.interrupts = array("Q", bytes(8 * SLOTS))  # calls per interrupt number
+        self.interrupt_time = array("d", bytes(8 * SLOTS))  # host seconds per interrupt number
+
+    def timed(self, handler):
+        """Wrap an interrupt handler (value, opt) to count and time every call."""
+        interrupts = self.interrupts
+        interrupt_time = self.interrupt_time
+        clock = time.perf_counter
+
+        def timed_handler(value, opt):
+            start = clock()
+            try:
+                handler(value, opt)
+            finally:
+                if 0 <= value < SLOTS:
+                    interrupts[value] += 1
+                    interrupt_time[value] += clock() - start
+        return timed_handler
+
+    def reset(self):
+        for counters in (self.opcodes, self.pairs, self.pcs, self.interrupts, self.interrupt_time):
+            if isinstance(counters, dict):
+                counters.clear()
+            else:
+                counters[:] = array(counters.typecode, bytes(8 * len(counters)))
+        self.previous = -1
+
+    def results(self):
+        """Non-zero counters, each sorted by count (highest first)."""
+        def ranked(counters):
+            items = counters.items() if isinstance(counters, dict) else enumerate(counters)
+            return sorted(((index, count) for index, count in items if count),
+                          key=lambda item: (-item[1], item[0]))
+        return {
+            "instructions": sum(self.opcodes),
+            "opcodes": [{"opcode": opcode, "name": OPCODE_NAMES.get(opcode, "?"), "count": count}
+                        for opcode, count in ranked(self.opcodes)],
+            "pairs": [{"first": index // SLOTS, "second": index % SLOTS, "name": self.pair_name(index),
+                       "count": count} for index, count in ranked(self.pairs)],
+            "pcs": [{"pc": pc, "count": count} for pc, count in ranked(self.pcs)],
+            "interrupts": [{"interrupt": value, "count": count, "seconds": self.interrupt_time[value]}
+                           for value, count in ranked(self.interrupts)],
+        }
+
+    @staticmethod
+    def pair_name(index):
+        return "+".join(OPCODE_NAMES.get(opcode, "?") for opcode in divmod(index, SLOTS))
+
+    def json(self, **kwargs):
+        return json.dumps(self.results(), **kwargs)
+
+    def report(self, limit=10):
+        """Text report of the limit hottest opcodes, opcode pairs, addresses and interrupts."""
+        results = self.results()
+        total = results["instructions"] or 1
+        lines = [f"Profile: {results['instructions']} instructions", "", "Opcodes:"]
+        for entry in results["opcodes"][:limit]:
+            lines.append(f"   {entry['name']:<5} 0x{entry['opcode']:02X}  {entry['count']:>12}"
+                         f"  {entry['count'] / total:6.1%}")
+        lines += ["", "Opcode pairs:"]
+        for entry in results["pairs"][:limit]:
+            lines.append(f"   {entry['name']:<11}  {entry['count']:>12}  {entry['count'] / total:6.1%}")
+        lines += ["", "Addresses:"]
+        for entry in results["pcs"][:limit]:
+            lines.append(f"   0x{entry['pc']:04X}  {entry['count']:>12}  {entry['count'] / total:6.1%}")
+        lines += ["", "Interrupts:"]
+        for entry in results["interrupts"][:limit]:
+            mean = entry["seconds"] / entry["count"]
+            lines.append(f"   0x{entry['interrupt']:02X}  {entry['count']:>12}"
+                         f"  {entry['seconds'] * 1000:10.3f} ms  {mean * 1e6:10.2f} us/call")
+        return "\n".join(lines)
@@ -0,0 +1,183 @@
+"""Lockstep execution of many CPUs running the same program.
+
+SimdMachine runs N guests ("lanes") that share one program but each have
+their own registers, memory, stack, PC and cycle count, all kept in
+NumPy arrays with the lane as the first axis. Every step picks the
+lowest PC among the running lanes and executes that instruction for all
+lanes sitting at it at once, so lanes that took different branches are
+run one group at a time and join up again when their PCs meet.
+
+For parameter sweeps: load a program, set machine.regs[:, r] (or
+memory) per lane, run(), and read the arrays back.
+
+Covered is the register, memory, stack and branch subset of the ISA
+(every opcode) plus int 0xFF (halt) and 0xFE (error). Other interrupts
+need the host, they fault the lanes reaching them like an unknown
+interrupt. Faults stop just the lanes they happen on and leave A = error
+type, B = PC, C = opcode, like CPU.run's error interrupt. Differences from CPU: registers and memory are 64-bit and
+wrap on overflow, and instructions are always fetched from the loaded
+program, stores into code only change data.
+"""
+
+import numpy as np
+
+from main import OPCODES, REGISTER_NAMES
+
+
+ERROR_VALUE = 0x1  # error types, as in CPU.run
+ERROR_OVERFLOW = 0x3
+ERROR_ZERO_DIVISION = 0x4
+
+STACK_SIZE = 32
+
+
+class SimdMachine:
+    def __init__(self, program, lanes, memory_size=256, stack_size=STACK_SIZE):
+        program = np.asarray(program, np.int64)
+        if len(program) > memory_size:
+            raise ValueError(f"Program too big for memory, size: {len(program)}")
+        self.lanes = lanes
+        self.program = np.zeros(memory_size, np.int64)
+        self.program[:len(program)] = program
+        self.regs = np.zeros((lanes, len(REGISTER_NAMES)), np.int64)
+        self.memory = np.tile(self.program, (lanes, 1))
+        self.stack = np.zeros((lanes, stack_size), np.int64)
+        self.sp = np.full(lanes, stack_size, np.int64)
+        self.pc = np.zeros(lanes, np.int64)
+        self.cycles = np.zeros(lanes, np.int64)
+        self.running = np.ones(lanes, bool)
+        self._decoded = {}  # PC -> (opcode, operands, length)
+
+    def _decode(self, addr):
+        instruction = self._decoded.get(addr)
+        if instruction is None:
+            memory = self.program
+            opcode = int(memory[addr])
+            length = OPCODES[opcode][1] if opcode in OPCODES else 3
+            operands = [int(value) for value in memory[addr + 1:addr + length]]
+            operands += [0] * (length - 1 - len(operands))  # runs off the end of memory
+            instruction = self._decoded[addr] = (opcode, operands, length)
+        return instruction
+
+    def run(self, max_cycles):
+        """Run every lane until it stops or has executed max_cycles instructions."""
+        memory_size = self.program.shape[0]
+        while True:
+            active = self.running & (self.cycles < max_cycles)
+            if not active.any():
+                return
+            pc = int(self.pc[active].min())
+            lanes = active & (self.pc == pc)
+            if lanes.all():
+                lanes = slice(None)  # basic indexing, no gather / scatter
+            else:
+                lanes = np.flatnonzero(lanes)
+
+            self.cycles[lanes] += 1
+            if pc >= memory_size:  # ran off the end of memory
+                self.running[lanes] = False
+                continue
+            opcode, operands, length = self._decode(pc)
+            self.pc[lanes] = pc + length
+            self._execute(lanes, pc, opcode, operands, length)
+
+    def _fault(self, lanes, error, opcode):
+        """Stop lanes with the error interrupt's registers."""
+        self.regs[lanes, 0] = error
+        self.regs[lanes, 1] = self.pc[lanes]
+        self.regs[lanes, 2] = opcode
+        self.running[lanes] = False
+
+    def _split(self, lanes, bad):
+        """Lanes (index array) of lanes for which bad (bool, per selected lane) is False and True."""
+        if isinstance(lanes, slice):
+            lanes = np.arange(self.lanes)
+        return lanes[~bad], lanes[bad]
+
+    def _execute(self, lanes, pc, opcode, operands, length):
+        regs = self.regs
+        if opcode not in OPCODES:
+            self._fault(lanes, ERROR_VALUE, opcode)
+            return
+        for reg in operands[:OPCODES[opcode][2]]:
+            if not 0 <= reg < regs.shape[1]:
+                self._fault(lanes, ERROR_VALUE, opcode)
+                return
+        a, b = operands[0], operands[1]
+
+        if opcode == 0x00:  # halt
+            self.running[lanes] = False
+        elif opcode == 0x01:  # ldw
+            regs[lanes, a] = b
+        elif opcode == 0x02:  # mov
+            regs[lanes, a] = regs[lanes, b]
+        elif opcode == 0x03:  # add
+            regs[lanes, a] += regs[lanes, b]
+        elif opcode == 0x04:  # sub
+            regs[lanes, a] -= regs[lanes, b]
+        elif opcode == 0x0F:  # xor
+            regs[lanes, a] ^= regs[lanes, b]
+        elif opcode == 0x10:  # and
+            regs[lanes, a] &= regs[lanes, b]
+        elif opcode == 0x12:  # mul
+            regs[lanes, a] *= regs[lanes, b]
+        elif opcode == 0x13:  # div
+            divisor = regs[lanes, b]
+            zero = divisor == 0
+            if zero.any():
+                lanes, faulted = self._split(lanes, zero)
+                self._fault(faulted, ERROR_ZERO_DIVISION, opcode)
+                divisor = regs[lanes, b]
+            regs[lanes, a] //= divisor
+        elif opcode in (0x05, 0x06):  # str, ldr
+            if not 0 <= b < self.memory.shape[1]:
+                self._fault(lanes, ERROR_VALUE, opcode)
+            elif opcode == 0x05:
+                self.memory[lanes, b] = regs[lanes, a]
+            else:
+                regs[lanes, a] = self.memory[lanes, b]
+        elif opcode in (0x08, 0x09, 0x14):  # bne, beq, blt
+            target = operands[2]
+            left, right = regs[lanes, a], regs[lanes, b]
+            taken = left != right if opcode == 0x08 else left == right if opcode == 0x09 else left < right
+            if opcode != 0x09 and not 0 <= target < self.memory.shape[1]:
+                lanes, faulted = self._split(lanes, taken)
+                self._fault(faulted, ERROR_VALUE, opcode)
+            else:
+                self.pc[lanes] = np.where(taken, target, pc + length)
+        elif opcode == 0x11:  # jmp
+            self.pc[lanes] = a
+        elif opcode in (0x0B, 0x0D):  # push, jsr
+            self.sp[lanes] -= 1
+            sp = self.sp[lanes]
+            overflow = sp < 0
+            if overflow.any():
+                lanes, faulted = self._split(lanes, overflow)
+                self._fault(faulted, ERROR_OVERFLOW, opcode)
+                sp = self.sp[lanes]
+            rows = np.arange(self.lanes)[lanes]
+            if opcode == 0x0B:
+                self.stack[rows, sp] = regs[lanes, a]
+            else:
+                self.stack[rows, sp] = pc + length + 3  # the return skips one instruction, like CPU._jsr
+                self.pc[lanes] = a
+        elif opcode in (0x0C, 0x0E):  # pop, ret
+            sp = self.sp[lanes]
+            underflow = sp >= self.stack.shape[1]
+            if underflow.any():
+                lanes, faulted = self._split(lanes, underflow)
+                self._fault(faulted, ERROR_OVERFLOW, opcode)
+                sp = self.sp[lanes]
+            rows = np.arange(self.lanes)[lanes]
+            value = self.stack[rows, sp]
+            self.stack[rows, sp] = 0
+            self.sp[lanes] += 1
+            if opcode == 0x0C:
+                regs[lanes, a] = value
+            else:
+                self.pc[lanes] = value
+        elif opcode == 0x0A:  # int
+            if a in (0xFE, 0xFF):  # the error interrupt stops the lane with its registers as they are
+                self.running[lanes] = False
+            else:  # needs the host, faults like an unknown interrupt on CPU
+                self._fault(lanes, ERROR_VALUE, opcode)
@@ -0,0 +1,137 @@
+"""Machine snapshots: save a CPU mid-run and resume it later.
+
+A snapshot is a little-endian binary file:
+
+    header     magic, format version, word size, running flag,
+               memory and stack size (in words), PC, SP, cycles,
+               paged flag (since version 2)
+    registers  per register: byte length (u16) and the value as a
+               signed integer (registers are not limited to a word)
+    memory     raw words, for paged memory (see memory.py) the number of
+               pages in use (u32) and per page its number (u32) and raw
+               words instead, then the raw stack words
+    input      0xF6 state (keydown, last key), held keys, queued key presses
+    display    mode, width, height, then the screen contents (see
+               HeadlessDisplay.snapshot)
+
+Memory is written from and read into the CPU's buffers without copies,
+so large memories load at about disk speed. Decoded instructions and
+compiled blocks are not saved, they are rebuilt on demand.
+"""
+
+import struct
+from array import array
+from collections import deque
+
+from memory import PAGE_BITS
+
+
+MAGIC = b"PY502SNP"
+VERSION = 2  # 2 added paged memory, version 1 files still load
+
+HEADER = struct.Struct("<8sHB?QQqqQ")  # magic, version, word size, running, memory, stack, PC, SP, cycles
+PAGED = struct.Struct("<?")  # version 2: memory is paged
+INPUT = struct.Struct("<?qqI")  # keydown, last key, current key, key buffer size
+DISPLAY = struct.Struct("<bQQQ")  # mode (-1 for none), width, height, contents length
+
+NO_KEY = -1
+
+
+def _write_int(f, value):
+    length = (value.bit_length() + 8) // 8  # room for the sign bit
+    f.write(struct.pack("<H", length) + value.to_bytes(length, "little", signed=True))
+
+
+def _read_int(f):
+    length, = struct.unpack("<H", _read(f, 2))
+    return int.from_bytes(_read(f, length), "little", signed=True)
+
+
+def _write_keys(f, keys):
+    keys = list(keys)
+    f.write(struct.pack("<I", len(keys)) + array("q", keys).tobytes())
+
+
+def _read_keys(f):
+    count, = struct.unpack("<I", _read(f, 4))
+    return array("q", _read(f, 8 * count)).tolist()
+
+
+def _read(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("Snapshot is truncated")
+    return data
+
+
+def _read_into(f, buffer):
+    view = memoryview(buffer).cast("B")
+    if f.readinto(view) != len(view):
+        raise ValueError("Snapshot is truncated")
+
+
+def save(cpu, f):
+    """Write cpu to the binary file object f."""
+    f.write(HEADER.pack(MAGIC, VERSION, cpu.word_size, cpu.running, len(cpu.memory), len(cpu.stack),
+                        cpu.PC, cpu.SP, cpu.cycles))
+    f.write(PAGED.pack(cpu.paged))
+    for value in cpu.regs:
+        _write_int(f, value)
+    if cpu.paged:
+        pages = cpu.memory.touched()
+        f.write(struct.pack("<I", len(pages)))
+        for start, page in pages:
+            f.write(struct.pack("<I", start >> PAGE_BITS))
+            f.write(memoryview(page).cast("B"))
+    else:
+        f.write(memoryview(cpu.memory).cast("B"))
+    f.write(memoryview(cpu.stack).cast("B"))
+
+    keyboard = cpu.keyboard
+    f.write(INPUT.pack(cpu.keydown, NO_KEY if cpu.last_key is None else cpu.last_key,
+                        NO_KEY if keyboard.current is None else keyboard.current, keyboard.buffer.maxlen))
+    _write_keys(f, sorted(keyboard.held))
+    _write_keys(f, keyboard.buffer)
+
+    mode, width, height, contents = cpu.display.snapshot()
+    f.write(DISPLAY.pack(-1 if mode is None else mode, width, height, len(contents)))
+    f.write(contents)
+
+
+def load(cpu, f):
+    """Restore cpu from the binary file object f, written by save()."""
+    magic, version, word_size, running, memory_size, stack_size, pc, sp, cycles = HEADER.unpack(
+        _read(f, HEADER.size))
+    if magic != MAGIC:
+        raise ValueError("Not a snapshot file")
+    if version not in (1, VERSION):
+        raise ValueError(f"Unsupported snapshot version: {version}")
+    paged, = PAGED.unpack(_read(f, PAGED.size)) if version > 1 else (False,)
+
+    regs = [_read_int(f) for _ in cpu.regs]
+    cpu._resize(memory_size, word_size, stack_size, paged)
+    if paged:
+        memory = cpu.memory
+        memory.pages[:] = [memory.zero] * len(memory.pages)
+        count, = struct.unpack("<I", _read(f, 4))
+        for _ in range(count):
+            number, = struct.unpack("<I", _read(f, 4))
+            if number >= len(memory.pages):
+                raise ValueError("Snapshot page out of range")
+            _read_into(f, memory.page(number))
+    else:
+        _read_into(f, cpu.memory)
+    _read_into(f, cpu.stack)
+    cpu.regs[:] = regs
+    cpu.PC, cpu.SP, cpu.cycles, cpu.running = pc, sp, cycles, running
+
+    keydown, last_key, current, buffer_size = INPUT.unpack(_read(f, INPUT.size))
+    cpu.keydown = keydown
+    cpu.last_key = None if last_key == NO_KEY else last_key
+    keyboard = cpu.keyboard
+    keyboard.held = set(_read_keys(f))
+    keyboard.current = None if current == NO_KEY else current
+    keyboard.buffer = deque(_read_keys(f), maxlen=buffer_size)
+
+    mode, width, height, length = DISPLAY.unpack(_read(f, DISPLAY.size))
+    cpu.display.restore(None if mode < 0 else mode, width, height, _read(f, length))
@@ -0,0 +1,53 @@
+import contextlib, io, itertools, pathlib
+
+import pytest
+
+import fusion
+from drives import DriveSet
+from main import CPU
+
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+CORPUS = [ROOT / path for path in fusion.CORPUS]
+
+
+def machine_state(cpu, output=""):
+    """Everything a run leaves behind that the guest or the host can see, for comparing runs."""
+    return {
+        "regs": list(cpu.regs), "pc": cpu.PC, "sp": cpu.SP, "cycles": cpu.cycles, "running": cpu.running,
+        "memory": cpu.memory.tolist(), "stack": cpu.stack.tolist(), "display": cpu.display.snapshot(),
+        "output": output,
+    }
+
+
+@pytest.fixture
+def machine(tmp_path):
+    """machine(**options): a headless CPU with its own drive directory holding an empty drive0."""
+    count = itertools.count()
+    cpus = []
+
+    def make(**options):
+        directory = tmp_path / f"drives{next(count)}"
+        directory.mkdir()
+        (directory / "drive0.bin").touch()
+        cpu = CPU(display="headless", drives=DriveSet(str(directory)), **options)
+        cpus.append(cpu)
+        return cpu
+    yield make
+    for cpu in cpus:
+        cpu.drives.close()
+
+
+@pytest.fixture
+def run(machine):
+    """run(program, max_cycles, steps=1, **options): run a new machine up to max_cycles in steps
+    calls of CPU.run, returns its machine_state."""
+    def run(program, max_cycles, steps=1, **options):
+        cpu = machine(**options)
+        cpu.load_program(program)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            for step in range(1, steps + 1):
+                cpu.run(max_cycles=max_cycles * step // steps)
+        return machine_state(cpu, output.getvalue())
+    return run
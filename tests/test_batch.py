@@ -0,0 +1,15 @@
+from assembler import assemble
+from batch import Job, run_batch
+
+
+PROGRAM = assemble("ldw a, 1\nloop:\nadd b, a\njmp loop\n", cache_dir=None).tolist()
+
+
+def test_failing_jobs_do_not_stop_the_batch():
+    jobs = [Job(PROGRAM, max_cycles=100), Job(PROGRAM, memory_size=1 << 25), Job("missing.img"),
+            Job(PROGRAM, memory={250: [1] * 9}), Job(PROGRAM, registers=[0] * 7), Job(PROGRAM, max_cycles=50)]
+    results = run_batch(jobs, workers=2)
+    assert [result.error is None for result in results] == [True, False, False, False, False, True]
+    assert results[0].cycles == 100 and results[5].cycles == 50
+    assert "Unsupported memory size" in results[1].error
+    assert results[2].error.startswith("FileNotFoundError")
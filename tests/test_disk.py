@@ -0,0 +1,56 @@
+import contextlib, io
+
+import pytest
+
+from assembler import assemble
+
+
+ROUND_TRIP = """
+    ldw a, 7
+    str a, 0x100
+    ldw a, 200
+    str a, 0x1FE
+    ldw a, 0          ; drive
+    ldw b, 2          ; sector
+    ldw c, 0x100      ; memory address
+    ldw d, 1          ; sectors
+    int 0x83
+    ldw c, 0x300
+    int 0x82
+    int 0xFF
+"""
+
+
+def run(cpu, source):
+    cpu.load_program(assemble(source, memory_limit=len(cpu.memory), cache_dir=None))
+    with contextlib.redirect_stdout(io.StringIO()):
+        cpu.run(max_cycles=1000)
+
+
+@pytest.mark.parametrize("options", [{"word_size": 2}, {}, {"paged": True}], ids=["words", "default", "paged"])
+def test_sectors_round_trip(machine, options):
+    cpu = machine(memory_size=1024, **options)
+    run(cpu, ROUND_TRIP)
+    assert cpu.regs[0] == 0  # no error interrupt
+    assert cpu.memory[0x300:0x3FF].tolist() == cpu.memory[0x100:0x1FF].tolist()
+    assert cpu.memory[0x300] == 7 and cpu.memory[0x3FE] == 200
+    with open(cpu.drives.path(0), "rb") as f:
+        assert f.read()[2 * 255:3 * 255] == bytes(cpu.memory[0x100:0x1FF].tolist())
+
+
+def test_byte_words_round_trip(machine):
+    cpu = machine(memory_size=256, word_size=1)
+    run(cpu, "ldw a, 0\nldw b, 2\nldw c, 0\nldw d, 1\nint 0x83\nint 0x82\nint 0xFF\n")  # the code to disk and back
+    assert cpu.regs[0] == 0 and not cpu.running
+    with open(cpu.drives.path(0), "rb") as f:
+        assert f.read()[2 * 255:3 * 255] == cpu.memory[:255].tobytes()
+
+
+@pytest.mark.parametrize("interrupt", [0x82, 0x83])
+@pytest.mark.parametrize("registers, code", [((12, 0), 0x81), ((0, 16), 0x82), ((3, 0), 0x84)],
+                         ids=["drive", "sector", "missing"])
+def test_disk_errors_before_memory_range(machine, interrupt, registers, code):
+    cpu = machine(memory_size=1024)
+    drive, sector = registers
+    run(cpu, f"ldw a, {drive}\nldw b, {sector}\nldw c, 5000\nldw d, 1\nint {interrupt}\nint 0xFF\n")
+    assert cpu.regs[0] == code
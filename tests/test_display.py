@@ -0,0 +1,24 @@
+import pytest
+
+from display import BITMAP_MODE, TEXT_MODE, HeadlessDisplay
+
+
+@pytest.mark.parametrize("save", ["save_ppm", "save_png"])
+@pytest.mark.parametrize("mode", [None, TEXT_MODE])
+def test_save_needs_bitmap_mode(tmp_path, save, mode):
+    display = HeadlessDisplay()
+    if mode is not None:
+        display.init(mode, 80, 32)
+    path = tmp_path / "screen"
+    with pytest.raises(ValueError):
+        getattr(display, save)(path)
+    assert not path.exists()
+
+
+def test_save_ppm(tmp_path):
+    display = HeadlessDisplay()
+    display.init(BITMAP_MODE, 3, 2)
+    display.set_pixel(0x123456, 2, 1)
+    path = tmp_path / "screen.ppm"
+    display.save_ppm(path)
+    assert path.read_bytes() == b"P6\n3 2\n255\n" + bytes(15) + b"\x12\x34\x56"
@@ -0,0 +1,21 @@
+import pytest
+
+from assembler import assemble, assemble_file
+from conftest import CORPUS
+
+
+PROGRAMS = {
+    "push_overflow": assemble("start:\n    push a\n    push b\n    push c\n    push d\n    jmp start\n", cache_dir=None),
+    "pop_underflow": [1, 0, 1, 11, 0, 0, 12, 1, 0, 12, 2, 0, 12, 3, 0, 17, 0, 0],
+    # add + str, the str faults on its address
+    "second_faults": [1, 0, 5, 3, 0, 0, 5, 0, 9999],
+}
+PROGRAMS.update((path.name, assemble_file(path, cache_dir=None)) for path in CORPUS)
+
+
+@pytest.mark.parametrize("name", PROGRAMS)
+@pytest.mark.parametrize("max_cycles", [1, 2, 7, 1000, 12345, 200001])
+@pytest.mark.parametrize("steps", [1, 3])
+def test_fused_matches_unfused(run, name, max_cycles, steps):
+    program = PROGRAMS[name]
+    assert run(program, max_cycles, steps, fuse=True) == run(program, max_cycles, steps, fuse=False)
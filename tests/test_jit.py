@@ -0,0 +1,38 @@
+import pytest
+
+from assembler import assemble_file
+from conftest import CORPUS
+
+
+# raw words, most of them fault half way through a block
+PROGRAMS = {
+    "alu": [1, 0, 0, 1, 1, 1, 1, 2, 3000, 3, 0, 1, 2, 3, 0, 15, 4, 4, 18, 3, 1, 16, 3, 2, 4, 5, 1, 20, 0, 2, 9,
+            10, 255, 0],
+    "calls": [1, 0, 0, 1, 1, 1, 1, 2, 500, 13, 21, 0, 0, 0, 0, 0, 0, 0, 17, 9, 0, 3, 0, 1, 11, 0, 0, 11, 1, 0,
+              12, 1, 0, 12, 0, 0, 20, 0, 2, 9, 10, 255, 0],
+    "self_modifying": [1, 0, 9, 1, 1, 1, 5, 1, 2, 10, 1, 0, 1, 2, 1, 3, 3, 2, 1, 4, 3, 20, 3, 4, 0, 10, 255, 0],
+    "store_into_block": [1, 0, 7, 1, 1, 2, 5, 1, 7, 1, 3, 5, 10, 255, 0],
+    "bad_branch": [1, 0, 1, 8, 0, 1, 200, 8, 0, 0, 250, 10, 255, 0],
+    "stack_overflow": [11, 0, 0, 17, 0, 0],
+    "stack_underflow": [1, 0, 4, 12, 0, 0],
+    "divide_by_zero": [1, 0, 4, 1, 1, 0, 19, 0, 1],
+    "unknown_opcode": [1, 0, 4, 7, 0, 0],
+    "bad_register": [1, 0, 4, 3, 0, 9],
+    "bad_address": [1, 0, 4, 5, 0, 999],
+    "off_the_end": [1, 0, 4, 1, 1, 5],
+    "return_without_call": [14, 0, 0],
+    "prints": [1, 0, 65, 10, 0, 0, 10, 1, 0, 0, 0, 0],
+}
+
+
+@pytest.mark.parametrize("path", CORPUS, ids=lambda path: path.name)
+@pytest.mark.parametrize("max_cycles, steps", [(50000, 1), (12345, 3)])
+def test_corpus_matches_interpreter(run, path, max_cycles, steps):
+    program = assemble_file(path, cache_dir=None)
+    assert run(program, max_cycles, steps, jit=True) == run(program, max_cycles, steps, jit=False)
+
+
+@pytest.mark.parametrize("name", PROGRAMS)
+def test_faults_match_interpreter(run, name):
+    program = PROGRAMS[name]
+    assert run(program, 100000, memory_size=64, jit=True) == run(program, 100000, memory_size=64, jit=False)
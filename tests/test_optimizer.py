@@ -0,0 +1,82 @@
+import pytest
+
+from assembler import assemble
+
+
+PROGRAMS = {
+    "dead_writes": """
+main:
+    ldw a, 5
+    ldw b, 7
+    add a, b
+    ldw a, 65
+    int 0x00
+    mov c, a
+    ldw c, 66
+    mov a, c
+    int 0x00
+    int 0xFF
+""",
+    "after_jsr": """
+main:
+    ldw a, 65
+    jsr print
+    ldw a, 0          ; skipped on return, dead but has to stay
+    ldw a, 1          ; dead
+    ldw a, 66
+    jsr print
+    mov a, a          ; skipped on return
+    int 0xFF
+print:
+    int 0x00
+    ret
+""",
+    "jump_threading": """
+main:
+    ldw a, 65
+    ldw b, 1
+    ldw c, 70
+    jmp first
+loop:
+    int 0x00
+    add a, b
+    bne a, c, first
+    jmp done
+first:
+    jmp second
+second:
+    jmp loop
+done:
+    jmp end
+end:
+    int 0xFF
+""",
+    "push_pop": """
+main:
+    ldw a, 48
+    ldw b, 1
+    ldw c, 58
+loop:
+    push a
+    pop a
+    int 0x00
+    push b
+    pop b
+    add a, b
+    bne a, c, loop
+    int 0xFF
+""",
+}
+
+
+@pytest.mark.parametrize("name", PROGRAMS)
+@pytest.mark.parametrize("jit", [False, True])
+def test_optimized_output_matches(run, name, jit):
+    plain = assemble(PROGRAMS[name], cache_dir=None)
+    optimized = assemble(PROGRAMS[name], cache_dir=None, optimize=True)
+    assert len(optimized) < len(plain)
+
+    expected, actual = run(plain, 100000, jit=jit), run(optimized, 100000, jit=jit)
+    assert not expected["running"]
+    for key in ("output", "display", "running"):
+        assert actual[key] == expected[key]
@@ -0,0 +1,59 @@
+import contextlib, io
+
+import pytest
+
+import snapshot
+from assembler import assemble_file
+from conftest import CORPUS, machine_state
+
+
+MODES = {"dense": {}, "paged": {"paged": True}, "jit": {"jit": True}}
+
+
+def run_to(cpu, max_cycles):
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        cpu.run(max_cycles=max_cycles)
+    return output.getvalue()
+
+
+@pytest.mark.parametrize("path", CORPUS, ids=lambda path: path.name)
+@pytest.mark.parametrize("mode", MODES)
+def test_resume_matches_uninterrupted_run(run, machine, path, mode):
+    program = assemble_file(path, cache_dir=None)
+    expected = run(program, 20000, **MODES[mode])
+
+    cpu = machine(**MODES[mode])
+    cpu.load_program(program)
+    output = run_to(cpu, 7777)
+    f = io.BytesIO()
+    cpu.save_snapshot(f)
+
+    resumed = machine(**MODES[mode])
+    f.seek(0)
+    resumed.load_snapshot(f)
+    output += run_to(resumed, 20000)
+    assert machine_state(resumed, output) == expected
+
+
+def test_loads_version_1(machine):
+    program = assemble_file(CORPUS[0], cache_dir=None)
+    cpu = machine()
+    cpu.load_program(program)
+    run_to(cpu, 5000)
+    f = io.BytesIO()
+    cpu.save_snapshot(f)
+
+    # version 1 is version 2 without the paged flag after the header
+    data = f.getvalue()
+    header = list(snapshot.HEADER.unpack(data[:snapshot.HEADER.size]))
+    header[1] = 1
+    old = snapshot.HEADER.pack(*header) + data[snapshot.HEADER.size + snapshot.PAGED.size:]
+
+    resumed = machine(paged=True)
+    resumed.load_snapshot(io.BytesIO(old))
+    assert not resumed.paged
+    assert machine_state(resumed) == machine_state(cpu)
+    run_to(cpu, 10000)
+    run_to(resumed, 10000)
+    assert machine_state(resumed) == machine_state(cpu)
@@ -0,0 +1,35 @@
+import contextlib, io
+
+from assembler import assemble
+from main import CPU
+
+
+# doubles A 70 times, past 2**63
+DOUBLING = """
+ldw A, 1
+ldw B, 0
+ldw C, 1
+ldw D, 70
+loop:
+add A, A
+add B, C
+bne B, D, loop
+int 0xFF
+"""
+
+
+def run(trace):
+    cpu = CPU(display="headless")
+    cpu.load_program(assemble(DOUBLING, cache_dir=None))
+    if trace:
+        cpu.trace(True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        cpu.run(max_cycles=1000)
+    return cpu
+
+
+def test_trace_large_register_values():
+    traced, plain = run(True), run(False)
+    assert traced.regs[0] == plain.regs[0] == 2 ** 70
+    assert (traced.PC, traced.cycles, traced.regs) == (plain.PC, plain.cycles, plain.regs)
+    assert ("A", 2 ** 70) in [entry[3:] for entry in traced.tracer.entries()]
@@ -0,0 +1,64 @@
+import contextlib, io
+
+import pytest
+
+import image
+from assembler import assemble
+from main import CPU
+
+
+NEGATIVE = """
+ldw a, -5
+ldw b, 0
+blt a, b, less
+ldw f, 2
+int 0xFF
+less:
+ldw f, 1
+ldw a, -1
+push a
+pop c
+str a, 0x80
+ldr d, 0x80
+int 0xFF
+"""
+
+
+def run(program, **options):
+    cpu = CPU(display="headless", **options)
+    cpu.load_program(program)
+    with contextlib.redirect_stdout(io.StringIO()):
+        cpu.run(max_cycles=1000)
+    return cpu
+
+
+def sources(tmp_path):
+    words = assemble(NEGATIVE, cache_dir=None)
+    path = tmp_path / "negative.img"
+    with open(path, "wb") as f:
+        image.save(f, [image.Section(0, image.CODE, words)])
+    return {"list": words.tolist(), "array": words, "image": str(path)}
+
+
+@pytest.mark.parametrize("jit", [False, True])
+@pytest.mark.parametrize("source", ["list", "array", "image"])
+def test_negative_values_round_trip(tmp_path, source, jit):
+    cpu = run(sources(tmp_path)[source], jit=jit)
+    assert cpu.regs == [-1, 0, -1, -1, 0, 1]  # blt taken, push/pop and str/ldr keep -1
+    assert cpu.memory[0x80] == -1
+
+
+@pytest.mark.parametrize("jit", [False, True])
+def test_narrow_words_wrap(jit):
+    program = assemble("ldw a, 0\nldw b, 1\nsub a, b\npush a\npop c\nstr a, 0x80\nldr d, 0x80\nint 0xFF\n",
+                       cache_dir=None)
+    cpu = run(program, word_size=1, jit=jit)
+    assert cpu.regs[:4] == [-1, 1, 0xFF, 0xFF]
+    assert cpu.memory[0x80] == 0xFF
+
+
+def test_image_loads_into_narrower_words(tmp_path):
+    words = assemble(NEGATIVE, cache_dir=None)
+    cpu = CPU(display="headless", word_size=2)
+    cpu.load_program(sources(tmp_path)["image"])
+    assert cpu.memory[:len(words)].tolist() == [word & 0xFFFF for word in words]
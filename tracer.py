@@ -0,0 +1,77 @@
+"""Instruction trace for the CPU.
+
+Keeps the last executed instructions, (PC, opcode, operands, changed
+register and its new value), in a ring buffer of preallocated arrays
+(a list for the values, registers aren't limited to a word).
+The CPU only records while tracing is switched on (see CPU.trace), and
+prints the newest entries when the error interrupt (0xFE) fires.
+"""
+
+from array import array
+
+from profiler import OPCODE_NAMES, REGISTER_NAMES
+
+
+TRACE_SIZE = 1024  # entries kept
+TRACE_DUMP = 16  # entries printed by the error interrupt
+
+
+class Tracer:
+    def __init__(self, size=TRACE_SIZE):
+        self.size = size
+        self.pcs = array("q", bytes(8 * size))
+        self.opcodes = array("q", bytes(8 * size))
+        self.operand_counts = array("B", bytes(size))
+        self.operands = [array("q", bytes(8 * size)) for _ in range(3)]
+        self.registers = array("b", b"\xff" * size)  # changed register, -1 for none
+        self.values = [0] * size  # its new value, any int
+        self.count = 0  # entries recorded since the start, the next slot is count % size
+
+    def record(self, pc, opcode, operands):
+        """Record an instruction about to execute, returns its slot for changed()."""
+        slot = self.count % self.size
+        self.count += 1
+        self.pcs[slot] = pc
+        self.opcodes[slot] = opcode
+        self.operand_counts[slot] = len(operands)
+        for index, operand in enumerate(operands):
+            self.operands[index][slot] = operand
+        self.registers[slot] = -1
+        return slot
+
+    def changed(self, slot, regs, before):
+        """Note the first register the instruction in slot changed."""
+        for index, value in enumerate(regs):
+            if value != before[index]:
+                self.registers[slot] = index
+                self.values[slot] = value
+                return
+
+    def entries(self, limit=None):
+        """Recorded entries, oldest first, as (pc, opcode, operands, register name or None, value)."""
+        kept = min(self.count, self.size)
+        if limit is not None:
+            kept = min(kept, limit)
+        result = []
+        for position in range(self.count - kept, self.count):
+            slot = position % self.size
+            operands = tuple(self.operands[index][slot] for index in range(self.operand_counts[slot]))
+            register = self.registers[slot]
+            result.append((self.pcs[slot], self.opcodes[slot], operands,
+                           REGISTER_NAMES[register] if register >= 0 else None,
+                           self.values[slot] if register >= 0 else None))
+        return result
+
+    def dump(self, limit=TRACE_DUMP):
+        """The newest limit entries as text, one instruction per line."""
+        lines = []
+        for pc, opcode, operands, register, value in self.entries(limit):
+            name = OPCODE_NAMES.get(opcode, f"0x{opcode:02X}")
+            line = f"   0x{pc:04X}  {name:<5} {', '.join(f'0x{operand:X}' for operand in operands):<20}"
+            if register is not None:
+                line += f"  {register} = 0x{value:X}"
+            lines.append(line.rstrip())
+        return "\n".join(lines)
+
+    def clear(self):
+        self.count = 0